@@ -0,0 +1,136 @@
+import re
+import statistics
+
+from repetition import split_sentences, word_matches
+
+# Frases hechas que los modelos de lenguaje repiten y que casi nadie escribe
+# en una tesis. Las palabras sueltas no van acá: solas no dicen nada.
+stock_phrases = [
+    "cabe destacar que", "es importante destacar que", "es importante señalar que", "es importante tener en cuenta que",
+    "es crucial", "es fundamental destacar", "vale la pena mencionar", "vale la pena destacar",
+    "en el panorama actual", "en el mundo actual", "en la era digital", "en el vertiginoso mundo",
+    "juega un papel crucial", "juega un papel fundamental", "desempeña un papel crucial", "desempeña un papel clave",
+    "un enfoque integral", "un enfoque holístico", "adentrarse en", "adentrémonos en", "sumergirse en",
+    "profundizar en el fascinante", "el fascinante mundo", "el vasto mundo", "un rico tapiz", "un testimonio de",
+    "en constante evolución", "a medida que avanzamos", "en última instancia", "una amplia gama de",
+    "aprovechar el poder", "desbloquear el potencial", "liberar el potencial", "navegar por las complejidades",
+    "abordar los desafíos", "arrojar luz sobre", "ofrece una visión integral", "sin lugar a dudas",
+]
+# conectores al principio de una oración; muchos en un mismo párrafo son otra señal
+connectors = [
+    "además", "asimismo", "igualmente", "por otro lado", "por otra parte", "en primer lugar", "en segundo lugar",
+    "en tercer lugar", "finalmente", "por último", "en conclusión", "en resumen", "en definitiva", "por lo tanto",
+    "por consiguiente", "sin embargo", "no obstante", "de este modo", "de esta manera", "en este sentido",
+    "en este contexto", "es decir",
+]
+
+# the statistics only mean something from this many sentences on
+min_sentences = 4
+# share of sentences that start with a connector
+min_connector_share = 0.4
+# coefficient of variation of the words per sentence: generated text is evenly paced
+max_length_variation = 0.25
+# moving-average type-token ratio over windows of this many words
+diversity_window = 50
+max_diversity = 0.6
+# signals (stock phrases, connectors, even sentences, low diversity) that flag a paragraph
+min_signals = 2
+
+
+def trie_pattern(phrases) -> str:
+    """A regular expression that matches any of `phrases`, factored as a trie:
+    the alternatives of each branch start with different characters, so at each
+    position at most one of them is followed and matching never backtracks
+    further than the longest phrase."""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for character in phrase:
+            node = node.setdefault(character, {})
+        node[""] = {}
+
+    def expression(node):
+        end = "" in node
+        branches = [re.escape(character) + expression(child) for character, child in sorted(node.items()) if character]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # the longest phrase wins, a shorter one is what's left when it doesn't match
+        return f"(?:{body})?" if end else body
+
+    return expression(trie)
+
+
+stock_phrase_pattern = re.compile(r"\b" + trie_pattern(stock_phrases) + r"\b", re.IGNORECASE)
+connector_pattern = re.compile(r"[\s¿¡\"'(«]*(" + trie_pattern(connectors) + r")\b", re.IGNORECASE)
+
+
+def moving_diversity(words, window: int = diversity_window) -> float:
+    """The mean type-token ratio of every window of `window` words, in one pass (the plain ratio for fewer words)."""
+    if len(words) < window:
+        return len(set(words)) / len(words) if words else 1.0
+    counts = {}
+    for word in words[:window]:
+        counts[word] = counts.get(word, 0) + 1
+    total = len(counts)
+    for index in range(window, len(words)):
+        old, new = words[index - window], words[index]
+        counts[old] -= 1
+        if not counts[old]:
+            del counts[old]
+        counts[new] = counts.get(new, 0) + 1
+        total += len(counts)
+    return total / (len(words) - window + 1) / window
+
+
+def phrasing_signals(text: str, sentences, words):
+    """The signals of generated text in a paragraph, as {name: measure}, and the
+    (start, end) of the connectors that start its sentences. `sentences` and
+    `words` are the repetition.split_sentences and word_matches of `text`."""
+    signals = {}
+    openings = []
+    lengths = []
+    word_index = 0
+    for start, end in sentences:
+        match = connector_pattern.match(text, start, end)
+        if match:
+            openings.append(match.span(1))
+        first = word_index
+        while word_index < len(words) and words[word_index][1] < end:
+            word_index += 1
+        if word_index > first:
+            lengths.append(word_index - first)
+    if len(lengths) >= min_sentences:
+        share = len(openings) / len(lengths)
+        if share >= min_connector_share:
+            signals["conectores"] = share
+        variation = statistics.pstdev(lengths) / statistics.mean(lengths)
+        if variation <= max_length_variation:
+            signals["oraciones parejas"] = variation
+        diversity = moving_diversity([word for word, _, _ in words])
+        if diversity <= max_diversity:
+            signals["vocabulario repetido"] = diversity
+    return signals, openings
+
+
+def mark_ai_phrasing(view, comments, sentences=None, words=None) -> int:
+    """Wraps the stock phrases of generated text in \\evidencIA and, when the
+    statistics of the paragraph point the same way, the connectors that open
+    its sentences. `sentences` and `words` are the split_sentences and
+    word_matches of view.text when already found."""
+    text = view.text
+    sentences = split_sentences(text) if sentences is None else sentences
+    words = word_matches(text) if words is None else words
+    phrases = [match.span() for match in stock_phrase_pattern.finditer(text)]
+    signals, openings = phrasing_signals(text, sentences, words)
+    if phrases:
+        signals["frases hechas"] = len(phrases)
+    for start, end in phrases:
+        view.add_mark(start, end, r'\evidencIA{', '}', "ai_phrasing", "Frase hecha típica de texto generado")
+        comments += 1
+    if len(signals) >= min_signals:
+        message = "Posible texto generado: " + ", ".join(signals)
+        for start, end in openings:
+            view.add_mark(start, end, r'\evidencIA{', '}', "ai_phrasing", message)
+            comments += 1
+    return comments
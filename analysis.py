@@ -0,0 +1,247 @@
+import signal
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from ai_phrasing import mark_ai_phrasing
+from prose import prose_category, prose_routes
+from spelling import mark_spelling
+from repetition import highlight_long_sentences, highlight_repeated_words, split_sentences, word_matches, word_tokens
+from utils import SegmentView, brace_depth, fix_cite_usage, mark_first_second_person, mark_passive_voice, mark_weasel_spanglish, max_brace_depth, parse_chunks
+
+
+class Paragraph:
+    """
+    A paragraph under review and the artifacts computed for it so far.
+    Every artifact is built the first time a checker asks for it and then
+    reused, so one that no enabled checker needs is never built. The Docs
+    come from `parser` (a function like utils.parse_chunks, the default).
+    """
+
+    def __init__(self, text: str, parser=parse_chunks):
+        self.text = text
+        self.parser = parser
+        self.edits = []  # changes fix_cite_usage made to the text, for the annotations
+        self.artifacts = {}
+        self.degraded = None  # why the checkers didn't all run, when they didn't
+        self.skipped = False  # no checker could run, the text is left as it is
+        self.category = None  # kind of paragraph according to prose.prose_category, once it's scored
+
+    def get(self, name: str):
+        if name not in self.artifacts:
+            self.artifacts[name] = artifact_builders[name](self)
+        return self.artifacts[name]
+
+    @property
+    def view(self) -> SegmentView:
+        return self.get("segments")
+
+
+# name: function that builds the artifact from the paragraph
+artifact_builders = {
+    # the LaTeX segments and the analyzable text
+    "segments": lambda paragraph: SegmentView(paragraph.text),
+    # the spaCy Docs of the analyzable text, as (offset, doc) pairs
+    "docs": lambda paragraph: list(paragraph.parser(paragraph.view.text)),
+    # the words counted for repetitions and the \w+ words
+    "tokens": lambda paragraph: word_tokens(paragraph.view.text),
+    "words": lambda paragraph: word_matches(paragraph.view.text),
+    "sentences": lambda paragraph: split_sentences(paragraph.view.text),
+}
+
+
+def check_cite_usage(analyzer, paragraph, comments):
+    # runs before anything asks for the segments, which are built over the fixed text.
+    # It stays here and not in utils.preprocess_lines: it depends on the rules and on
+    # lint_only, a \cite can span lines, and its edits are kept per paragraph so the
+    # annotations point at the original text
+    if analyzer.fix_citations:
+        paragraph.text = fix_cite_usage(paragraph.text, paragraph.edits)
+    return comments
+
+
+def check_passive_voice(analyzer, paragraph, comments):
+    return mark_passive_voice(paragraph.view, comments, paragraph.get("docs"), analyzer.matchers)
+
+
+def check_person(analyzer, paragraph, comments):
+    return mark_first_second_person(paragraph.view, comments, paragraph.get("docs"), analyzer.matchers)
+
+
+def check_weasel(analyzer, paragraph, comments):
+    return mark_weasel_spanglish(analyzer.weasels, [], paragraph.view, comments)
+
+
+def check_spanglish(analyzer, paragraph, comments):
+    return mark_weasel_spanglish([], analyzer.spanglish, paragraph.view, comments)
+
+
+def check_spelling(analyzer, paragraph, comments):
+    # without a dictionary installed or given there's nothing to check against
+    if analyzer.dictionary is None:
+        return comments
+    return mark_spelling(analyzer.dictionary, paragraph.view, comments, paragraph.get("words"), analyzer.known_words)
+
+
+def check_ai_phrasing(analyzer, paragraph, comments):
+    return mark_ai_phrasing(paragraph.view, comments, paragraph.get("sentences"), paragraph.get("words"))
+
+
+def check_long_sentence(analyzer, paragraph, comments):
+    highlight_long_sentences(paragraph.view, analyzer.ignore_words, 40,
+                             paragraph.get("sentences"), paragraph.get("words"))
+    return comments
+
+
+def check_repetition(analyzer, paragraph, comments):
+    highlight_repeated_words(paragraph.view, ['Green', 'Cerulean', 'red'], 200, analyzer.ignore_words,
+                             paragraph.get("tokens"), paragraph.get("words"), analyzer.compact)
+    return comments
+
+
+# name: (artifacts it needs, checker), in the order they run. The order
+# matters: a mark that crosses one added before it is dropped.
+checkers = {
+    "cite_usage": ((), check_cite_usage),
+    "passive_voice": (("segments", "docs"), check_passive_voice),
+    "person": (("segments", "docs"), check_person),
+    "weasel": (("segments",), check_weasel),
+    "spanglish": (("segments",), check_spanglish),
+    "spelling": (("segments", "words"), check_spelling),
+    "ai_phrasing": (("segments", "sentences", "words"), check_ai_phrasing),
+    "long_sentence": (("segments", "sentences", "words"), check_long_sentence),
+    "repetition": (("segments", "tokens", "words"), check_repetition),
+}
+# checked outside the paragraphs: the chapter and section headings, and the
+# \cite and \ref keys of the whole document (see references.CrossReferences)
+document_rules = ("headings", "references")
+rule_names = tuple(checkers) + document_rules
+# checkers that only look words up in the lexicons: what's left of the review
+# of a paragraph that goes over its time budget or fails
+lexicon_rules = ("cite_usage", "weasel", "spanglish")
+
+degraded_messages = {
+    "timeout": "La revisión de este párrafo superó el tiempo límite de {} s",
+    "error": "La revisión de este párrafo falló ({})",
+    "nesting": "Este párrafo anida más de {} niveles de llaves",
+}
+
+
+class ParagraphTimeout(Exception):
+    """The checkers of a paragraph went over the time budget."""
+
+
+@contextmanager
+def time_limit(seconds):
+    """Raises ParagraphTimeout inside the block once `seconds` have passed. It
+    needs SIGALRM, so it only interrupts in the main thread on Unix."""
+    if not seconds or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise ParagraphTimeout()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class Analyzer:
+    """
+    Runs the enabled checkers (every one when `rules` is None) over each
+    paragraph, in at most `time_budget` seconds (None for no limit). With
+    `preflight` the paragraphs that aren't prose (tables, code, URLs...) only
+    get the checkers of their route in prose.prose_routes; `categories`
+    counts the paragraphs of each kind. `parser` parses the paragraphs (see
+    Paragraph) and `matchers` are the compiled rule Matchers to use instead of
+    the ones of utils (see utils.match_rules). The spelling is checked against
+    `dictionary` (a spelling.SpellingDictionary, None turns it off), where the
+    words of the `glossary` and of the lexicons are taken as right.
+    """
+
+    def __init__(self, rules=None, weasels=(), spanglish=(), ignore_words=(), fix_citations=True, compact=False, time_budget=None,
+                 preflight=True, parser=parse_chunks, dictionary=None, glossary=(), matchers=None):
+        unknown = set(rules or ()) - set(rule_names)
+        if unknown:
+            raise ValueError(f"Unknown rules {sorted(unknown)}, expected some of {rule_names}")
+        self.rules = set(rule_names if rules is None else rules)
+        self.weasels = weasels
+        self.spanglish = spanglish
+        self.ignore_words = ignore_words
+        self.fix_citations = fix_citations
+        self.compact = compact
+        self.time_budget = time_budget
+        self.preflight = preflight
+        self.parser = parser
+        self.dictionary = dictionary
+        self.matchers = matchers
+        # the lexicon words are marked by their own checkers
+        self.known_words = set(glossary) | {word.lower() for word in (*weasels, *spanglish) if " " not in word}
+        self.categories = Counter()
+        self.enabled = [(name, checker) for name, (_, checker) in checkers.items() if name in self.rules]
+        self.fallback = [(name, checker) for name, checker in self.enabled if name in lexicon_rules]
+
+    def analyze(self, text: str, comments: int = 0):
+        """
+        Runs the enabled checkers over `text`; returns the Paragraph with its
+        marks and the comment count. When they go over the time budget or
+        fail the paragraph is checked again with the lexicon checkers only,
+        and when those fail too it's left without marks (paragraph.skipped).
+        paragraph.degraded says why. Past max_brace_depth levels of braces
+        utils.separate_latex_commands leaves the whole paragraph out, so it's
+        skipped without running any checker.
+        """
+        paragraph = Paragraph(text, self.parser)
+        if brace_depth(text) > max_brace_depth:
+            paragraph.degraded = degraded_messages["nesting"].format(max_brace_depth)
+            paragraph.skipped = True
+            return paragraph, comments
+        try:
+            comments = self.run_checkers(self.enabled, paragraph, comments)
+            if paragraph.category:
+                self.categories[paragraph.category] += 1
+            return paragraph, comments
+        except Exception as e:
+            reason = self.failure_reason(e)
+        paragraph = Paragraph(text, self.parser)
+        paragraph.degraded = reason
+        try:
+            return paragraph, self.run_checkers(self.fallback, paragraph, comments)
+        except Exception:
+            paragraph = Paragraph(text, self.parser)
+            paragraph.degraded = reason
+            paragraph.skipped = True
+            return paragraph, comments
+
+    def run_checkers(self, enabled, paragraph, comments):
+        start = time.monotonic()
+        with time_limit(self.time_budget):
+            for name, checker in enabled:
+                # where SIGALRM can't interrupt, the budget is checked between checkers
+                if self.time_budget and time.monotonic() - start > self.time_budget:
+                    raise ParagraphTimeout()
+                # scored on the segments, once the checkers that change the text have run
+                if self.preflight and paragraph.category is None and "segments" in checkers[name][0]:
+                    paragraph.category = prose_category(paragraph.view)
+                route = prose_routes.get(paragraph.category)
+                if route == "skip" or (route == "lexicon" and name not in lexicon_rules):
+                    continue
+                comments = checker(self, paragraph, comments)
+        return comments
+
+    def failure_reason(self, error: Exception) -> str:
+        if isinstance(error, ParagraphTimeout):
+            return degraded_messages["timeout"].format(f"{self.time_budget:g}")
+        return degraded_messages["error"].format(type(error).__name__)
+
+
+def degraded_note(paragraph: Paragraph) -> str:
+    """The \\notaparaelautor of a paragraph whose review didn't run whole."""
+    rest = "no se revisó" if paragraph.skipped else "solo se buscaron las palabras de los listados"
+    return f"\\notaparaelautor{{{paragraph.degraded}; {rest}.}}\n"
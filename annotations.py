@@ -0,0 +1,117 @@
+import bisect
+import json
+from collections import Counter, defaultdict
+
+from utils import detect_bad_citations
+
+
+class Annotations:
+    """
+    Collects every finding of a review as a JSON record with its rule, the
+    position in the source file (1-based line and column), the text of the
+    span and the suggestion, plus the count of findings per rule and chapter.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.records = []
+        self.chapter = None
+        self.chapter_counts = defaultdict(Counter)
+
+    def start_chapter(self, title: str):
+        self.chapter = title
+
+    def add(self, rule: str, position, end_position, span: str, message: str):
+        line, column = position
+        end_line, end_column = end_position
+        self.records.append({
+            "type": "finding",
+            "rule": rule,
+            "file": self.file_path,
+            "line": line,
+            "column": column,
+            "end_line": end_line,
+            "end_column": end_column,
+            "span": span,
+            "suggestion": message,
+            "chapter": self.chapter,
+        })
+        self.chapter_counts[self.chapter][rule] += 1
+
+    def add_paragraph(self, view, paragraph: "ParagraphPositions", edits=()):
+        """Adds the marks of `view`. `edits` are the changes fix_cite_usage made
+        to the paragraph before the view was built over it."""
+        for start, end, _, _, rule, message in view.marks:
+            original_start = undo_edits(view.to_original(start), edits)
+            original_end = undo_edits(view.to_original(end - 1), edits) + 1
+            self.add(rule, paragraph.locate(original_start), paragraph.locate(original_end),
+                     view.text[start:end], message)
+
+    def add_citations(self, text: str, paragraph: "ParagraphPositions"):
+        for start, end in detect_bad_citations(text):
+            self.add("citation", paragraph.locate(start), paragraph.locate(end),
+                     text[start:end], "Incorrect citation format")
+
+    def add_overuse(self, scope: str, title: str, lemmas):
+        """One record per chapter or section with overused lemmas, as (lemma, count)."""
+        self.records.append({
+            "type": "overuse",
+            "file": self.file_path,
+            "scope": scope,
+            "title": title,
+            "lemmas": dict(lemmas),
+        })
+
+    def add_since(self, revision: str, reviewed: int, total: int):
+        """Records that only `reviewed` of the `total` paragraphs, the ones changed since `revision`, were reviewed."""
+        self.records.append({
+            "type": "since",
+            "file": self.file_path,
+            "revision": revision,
+            "reviewed": reviewed,
+            "paragraphs": total,
+        })
+
+    def summary(self):
+        """One record per chapter with the amount of findings of each rule."""
+        return [
+            {"type": "chapter_summary", "file": self.file_path, "chapter": chapter,
+             "total": sum(counts.values()), "counts": dict(counts)}
+            for chapter, counts in self.chapter_counts.items()
+        ]
+
+    def write(self, output_path: str):
+        """Writes the findings and the chapter summaries as JSON Lines."""
+        with open(output_path, "w", encoding="utf-8") as f:
+            for record in self.records + self.summary():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class ParagraphPositions:
+    """Maps offsets in a paragraph joined from several lines back to the source file."""
+
+    def __init__(self):
+        self.offsets = []    # offset in the paragraph where each line starts
+        self.positions = []  # (line, column) of that line in the source file
+
+    def add_line(self, offset: int, position):
+        self.offsets.append(offset)
+        self.positions.append(position)
+
+    def locate(self, offset: int):
+        index = max(bisect.bisect_right(self.offsets, offset) - 1, 0)
+        line, column = self.positions[index]
+        return line, column + offset - self.offsets[index]
+
+
+def undo_edits(offset: int, edits) -> int:
+    """Maps an offset in an edited text back to the text before the edits.
+    Offsets that fall inside a replacement map to the start of the replaced span."""
+    shift = 0
+    for start, end, new_length in edits:
+        if offset < start + shift:
+            break
+        if offset < start + shift + new_length:
+            return start
+        shift += new_length - (end - start)
+    return offset - shift
@@ -0,0 +1,42 @@
+import argparse
+import os
+import tempfile
+import time
+
+from pre_processing import process_tex_file
+from utils import nlp_modes, set_nlp_mode
+
+
+def time_mode(file_path, mode, repeat, lint_only):
+    """Returns the load time of the pipeline of `mode` and the time of each review of `file_path`."""
+    start = time.perf_counter()
+    set_nlp_mode(mode)
+    load_time = time.perf_counter() - start
+
+    times = []
+    with tempfile.TemporaryDirectory() as folder:
+        output_tex = os.path.join(folder, "revisado.tex")
+        annotations = os.path.join(folder, "revisado.jsonl") if lint_only else None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process_tex_file(file_path, output_tex, annotations, lint_only, mode)
+            times.append(time.perf_counter() - start)
+    return load_time, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the review of a LaTeX file with each spaCy mode.")
+    parser.add_argument("file_path", help="LaTeX file to review")
+    parser.add_argument("--modes", nargs="+", choices=nlp_modes, default=list(nlp_modes))
+    parser.add_argument("--repeat", type=int, default=3, help="reviews per mode (default: 3)")
+    parser.add_argument("--lint-only", action="store_true", help="time the lint-only mode instead of the full rendering")
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'load (s)':>10} {'best (s)':>10} {'mean (s)':>10}")
+    for mode in args.modes:
+        load_time, times = time_mode(args.file_path, mode, args.repeat, args.lint_only)
+        print(f"{mode:<10} {load_time:>10.3f} {min(times):>10.3f} {sum(times) / len(times):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import bisect
+import os
+import re
+import subprocess
+
+# the new side of a hunk header of git diff: @@ -a[,b] +start[,count] @@
+hunk_pattern = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+
+
+def git(args, folder: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["git"] + args, cwd=folder, capture_output=True, text=True)
+
+
+class ChangedLines:
+    """
+    The lines of a file that changed since the revision `since` of its git
+    repository, the uncommitted changes included, as sorted (first, last)
+    ranges of 1-based line numbers. Where lines were only deleted the lines
+    on both sides count as changed, and a file the revision doesn't have
+    changed entirely.
+    """
+
+    def __init__(self, file_path: str, since: str):
+        self.since = since
+        folder = os.path.dirname(os.path.abspath(file_path))
+        name = os.path.basename(file_path)
+        result = git(["rev-parse", "--verify", "--quiet", since + "^{commit}"], folder)
+        if result.returncode != 0:
+            raise ValueError(f"'{since}' is not a revision of the git repository of {file_path}")
+
+        if git(["cat-file", "-e", f"{since}:./{name}"], folder).returncode != 0:
+            self.ranges = [(1, float("inf"))]
+        else:
+            result = git(["diff", "--unified=0", "--no-color", "--no-ext-diff", since, "--", name], folder)
+            if result.returncode != 0:
+                raise ValueError(f"git diff failed: {result.stderr.strip()}")
+            self.ranges = []
+            for match in hunk_pattern.finditer(result.stdout):
+                start = int(match.group(1))
+                count = 1 if match.group(2) is None else int(match.group(2))
+                if count == 0:
+                    # only deletions: git gives the line before them
+                    self.ranges.append((max(start, 1), start + 1))
+                else:
+                    self.ranges.append((start, start + count - 1))
+        self.ends = [end for _, end in self.ranges]
+
+    def touches(self, first: int, last: int) -> bool:
+        """Whether any line from first to last (both included) changed."""
+        index = bisect.bisect_left(self.ends, first)
+        return index < len(self.ranges) and self.ranges[index][0] <= last
+
+
+def since_note(since: str, reviewed: int, total: int) -> str:
+    # \detokenize keeps the ~ and ^ of the revision as text
+    revision = "\\texttt{\\detokenize{" + since + "}}"
+    return (f"\n\\notaparaelautor{{Solo se revisaron los párrafos cambiados desde {revision}: "
+            f"{reviewed} de {total}. El resto no se volvió a revisar.}}\n")
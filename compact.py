@@ -0,0 +1,75 @@
+import bisect
+
+# findings that become a \todo margin note in the normal output
+note_rules = {"passive_voice", "person", "anglicism"}
+# findings closer than this many characters share a note even across sentences
+adjacent_chars = 30
+# margin notes allowed in each page-sized chunk of text; the rest are listed
+# in a summary at the end of the chapter
+page_chars = 3000
+notes_per_page = 6
+
+
+class CompactNotes:
+    """
+    Turns the margin-note findings of each paragraph into the compact output
+    of word-comments.tex. The findings of a sentence, and the ones next to
+    each other, are highlighted with \\resaltado and share one numbered
+    \\notamargen. At most notes_per_page margin notes are made in each chunk of
+    page_chars characters; the rest only get their number (\\notafinal) and
+    their message is listed in the \\resumennotas of the chapter.
+    """
+
+    def __init__(self):
+        self.number = 0
+        self.page_used = 0
+        self.page_notes = 0
+        self.overflow = []  # (number, messages) of the current chapter
+
+    def add_paragraph(self, view, sentences):
+        """Rewrites the note marks of `view`; `sentences` are the split_sentences of view.text."""
+        sentence_starts = [start for start, _ in sentences]
+        groups = []
+        last_end = last_sentence = None
+        # only the marks that will be rendered, so every note has a place
+        for index in sorted(view.accepted_marks(), key=lambda i: view.marks[i][0]):
+            start, end, _, _, rule, message = view.marks[index]
+            if rule not in note_rules:
+                continue
+            sentence = bisect.bisect_right(sentence_starts, start) - 1
+            if groups and (sentence == last_sentence or start - last_end <= adjacent_chars):
+                groups[-1].append(index)
+                last_end = max(last_end, end)
+            else:
+                groups.append([index])
+                last_end = end
+            last_sentence = sentence
+
+        for group in groups:
+            self.number += 1
+            messages = "; ".join(dict.fromkeys(view.marks[index][5] for index in group))
+            if self.page_notes < notes_per_page:
+                self.page_notes += 1
+                note = f"\\notamargen{{{self.number}}}{{{messages}}}"
+            else:
+                self.overflow.append((self.number, messages))
+                note = f"\\notafinal{{{self.number}}}"
+            # after the mark that ends last, the first one of those that end there (the
+            # outermost, it closes after them), so the note comes after the whole group
+            closing = max(group, key=lambda index: view.marks[index][1])
+            for index in group:
+                start, end, _, _, rule, message = view.marks[index]
+                after = "}" + note if index == closing else "}"
+                view.marks[index] = (start, end, "\\resaltado{", after, rule, message)
+
+        self.page_used += len(view.paragraph)
+        if self.page_used >= page_chars:
+            self.page_used = self.page_notes = 0
+
+    def chapter_summary(self) -> str:
+        """The \\resumennotas of the notes that didn't fit in the margin since the last call."""
+        if not self.overflow:
+            return ""
+        listed = " ".join(f"\\textbf{{{number}:}} {messages}." for number, messages in self.overflow)
+        self.overflow = []
+        return "\\resumennotas{" + listed + "}\n"
@@ -0,0 +1,87 @@
+"""
+Reviews a document once per hash seed, each in a new interpreter, and fails
+(exit status 1) when the outputs differ or a review leaves no output. From the
+folder of the repository:
+
+    python determinism.py [file.tex] [--compact] [--overuse]
+
+Without a file it reviews a generated document.
+"""
+import argparse
+import hashlib
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from scaling import make_document
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+# hash seeds the review runs with; "random" makes Python pick one each run
+default_seeds = ["0", "1", "2", "12345", "random"]
+
+
+def file_digest(path: str):
+    """The sha256 of the file, None when it's missing or empty."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def review_digests(file_path, folder, seed, options):
+    """Reviews `file_path` in a new interpreter with PYTHONHASHSEED=seed; returns the digest of every
+    output file (None for the missing or empty ones) and what the review printed."""
+    output_tex = os.path.join(folder, f"revisado-{seed}.tex")
+    annotations = os.path.join(folder, f"revisado-{seed}.jsonl")
+    env = dict(os.environ, PYTHONHASHSEED=seed)
+    review = subprocess.run([sys.executable, os.path.join(repo_dir, "pre_processing.py"), file_path, output_tex,
+                             "--annotations", annotations, "--deterministic"] + options,
+                            env=env, cwd=repo_dir, stdout=subprocess.PIPE, text=True)
+    return {"tex": file_digest(output_tex), "annotations": file_digest(annotations)}, review.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that the review gives byte-identical output under several hash seeds (python determinism.py).")
+    parser.add_argument("file_path", nargs="?", help="LaTeX file to review (default: a generated document)")
+    parser.add_argument("--seeds", nargs="+", default=default_seeds, help="values of PYTHONHASHSEED (default: %(default)s)")
+    parser.add_argument("--size", type=int, default=40, help="paragraphs of the generated document (default: 40)")
+    parser.add_argument("--compact", action="store_true", help="review with the compact output")
+    parser.add_argument("--overuse", action="store_true", help="also index the lemmas and summarize the overused words")
+    args = parser.parse_args()
+    options = [flag for flag, enabled in (("--compact", args.compact), ("--overuse", args.overuse)) if enabled]
+
+    with tempfile.TemporaryDirectory() as folder:
+        # the reviews run in the folder of the repository
+        file_path = args.file_path and os.path.abspath(args.file_path)
+        if file_path is None:
+            file_path = os.path.join(folder, "generado.tex")
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write("\\documentclass{report}\n\\begin{document}\n\\chapter{Uno}\n\n"
+                        + make_document(args.size, random.Random(0)) + "\n\\end{document}\n")
+        reviews = {seed: review_digests(file_path, folder, seed, options) for seed in args.seeds}
+
+    expected = reviews[args.seeds[0]][0]
+    different = missing = False
+    print(f"{'seed':<10} {'tex':<16} {'annotations':<16}")
+    for seed, (digest, output) in reviews.items():
+        if None in digest.values():
+            # an error is printed instead of failing, the output says which
+            status = "  NO OUTPUT\n" + output.rstrip()
+            missing = True
+        else:
+            status = "" if digest == expected else "  DIFFERENT"
+            different = different or bool(status)
+        print(f"{seed:<10} {(digest['tex'] or '-')[:12]:<16} {(digest['annotations'] or '-')[:12]:<16}{status}")
+
+    if missing:
+        print("A review left an output file missing or empty")
+    if different:
+        print("The output depends on the hash seed")
+    if missing or different:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import time
+
+from analysis import Analyzer, lexicon_rules
+from pre_processing import ignore_for_repetition, spanglish, weasels
+from utils import set_nlp_mode
+
+default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluation_corpus.jsonl")
+# rules with gold spans in the corpus
+evaluated_rules = ("passive_voice", "person", "weasel", "repetition")
+
+# name: spaCy mode (None when no checker needs it) and the checkers that run (None for all)
+configurations = {
+    "accurate": ("accurate", None),
+    "fast": ("fast", None),
+    # no spaCy at all: the lexicons and the word counts only
+    "model-free": (None, lexicon_rules + ("long_sentence", "repetition")),
+}
+
+
+def read_corpus(path: str):
+    """The paragraphs of a JSON Lines corpus, each with its gold spans as {rule: [(start, end)]}.
+    A gold span is given by its text and, when it isn't the first, the occurrence of it in the paragraph."""
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            gold = {rule: [] for rule in evaluated_rules}
+            for span in item["gold"]:
+                start = -1
+                for _ in range(span.get("occurrence", 1)):
+                    start = item["text"].find(span["text"], start + 1)
+                if start < 0:
+                    raise ValueError(f"'{span['text']}' isn't in the paragraph {item['id']}")
+                gold.setdefault(span["rule"], []).append((start, start + len(span["text"])))
+            corpus.append((item["id"], item["text"], gold))
+    return corpus
+
+
+def predicted_spans(analyzer, text: str):
+    """The marks of every checker over `text` as {rule: [(start, end)]} in the paragraph."""
+    paragraph, _ = analyzer.analyze(text)
+    view = paragraph.view
+    spans = {}
+    for start, end, _, _, rule, _ in view.marks:
+        spans.setdefault(rule, []).append((view.to_original(start), view.to_original(end - 1) + 1))
+    return spans
+
+
+def overlaps(a, b) -> bool:
+    return a[0] < b[1] and b[0] < a[1]
+
+
+def run_configuration(name: str, corpus, repeat: int):
+    """Returns the load time of the pipeline, the best time over the corpus and the counts of each rule."""
+    mode, rules = configurations[name]
+    start = time.perf_counter()
+    if mode:
+        set_nlp_mode(mode)
+    load_time = time.perf_counter() - start
+    analyzer = Analyzer(rules, weasels, spanglish, ignore_for_repetition, fix_citations=False)
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predictions = [predicted_spans(analyzer, text) for _, text, _ in corpus]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # rule: [gold spans, gold spans found, predicted spans, predicted spans right]
+    counts = {rule: [0, 0, 0, 0] for rule in evaluated_rules}
+    for (_, _, gold), predicted in zip(corpus, predictions):
+        for rule, count in counts.items():
+            gold_spans, found = gold.get(rule, []), predicted.get(rule, [])
+            count[0] += len(gold_spans)
+            count[1] += sum(any(overlaps(g, p) for p in found) for g in gold_spans)
+            count[2] += len(found)
+            count[3] += sum(any(overlaps(p, g) for g in gold_spans) for p in found)
+    return load_time, best, counts
+
+
+def ratio(part, whole):
+    return part / whole if whole else None
+
+
+def cell(value) -> str:
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precision, recall and throughput of each checker configuration over a hand-labelled corpus.")
+    parser.add_argument("corpus", nargs="?", default=default_corpus, help="JSON Lines corpus (default: evaluation_corpus.jsonl)")
+    parser.add_argument("--configurations", nargs="+", choices=list(configurations), default=list(configurations))
+    parser.add_argument("--repeat", type=int, default=3, help="runs over the corpus per configuration, the best one is timed (default: 3)")
+    args = parser.parse_args()
+
+    corpus = read_corpus(args.corpus)
+    characters = sum(len(text) for _, text, _ in corpus)
+    results = {name: run_configuration(name, corpus, args.repeat) for name in args.configurations}
+
+    print(f"{len(corpus)} paragraphs, {characters} characters\n")
+    print(f"{'configuration':<14} {'rule':<14} {'gold':>5} {'found':>6} {'precision':>10} {'recall':>7} {'F1':>5}")
+    for name, (_, _, counts) in results.items():
+        for rule, (gold, found_gold, found, right) in counts.items():
+            precision, recall = ratio(right, found), ratio(found_gold, gold)
+            if precision is None or recall is None:
+                f1 = None
+            else:
+                f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            print(f"{name:<14} {rule:<14} {gold:>5} {found:>6} {cell(precision):>10} {cell(recall):>7} {cell(f1):>5}")
+
+    print(f"\n{'configuration':<14} {'load (s)':>9} {'best (s)':>9} {'paragraphs/s':>13} {'chars/s':>10}")
+    for name, (load_time, best, _) in results.items():
+        print(f"{name:<14} {load_time:>9.3f} {best:>9.3f} {len(corpus) / best:>13.1f} {characters / best:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
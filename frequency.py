@@ -0,0 +1,183 @@
+import argparse
+import array
+import functools
+import os
+import re
+import sys
+import zlib
+from collections import Counter
+
+from spelling import compiled_index, normalize
+
+# Spanish word frequencies as "word count" lines, most frequent first (a list
+# like the ones of FrequencyWords, or one counted with `python frequency.py`)
+default_frequencies = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frecuencias_es.txt")
+frequency_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "frequencies")
+# 12 bytes of format version, then the number of words and of slots in 4 each
+index_magic = b"FRECUENCIAS1"
+# words up to this rank are frequent enough in Spanish that repeating them says nothing
+default_max_rank = 300
+word_pattern = re.compile(r"\w+")
+
+
+def slot_hash(word: bytes) -> int:
+    # crc32 and not hash(): the same in every process, whatever PYTHONHASHSEED is
+    return zlib.crc32(word)
+
+
+def compile_frequencies(lines) -> bytes:
+    """
+    The index of a frequency list: the header, the offsets of the words
+    (uint32), the rank of each word by its id (uint32), an open-addressing
+    hash table of 2^k slots with id + 1 (uint32, 0 is empty) and the UTF-8
+    words, all in the byte order of the machine. The id of a word is its
+    place in the list, the rank is 1 for the most frequent one; words
+    without a count are ranked by their line.
+    """
+    counts = {}
+    for number, line in enumerate(lines):
+        fields = line.split()
+        if not fields:
+            continue
+        word = normalize(fields[0]).encode("utf-8")
+        count = int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else -number
+        counts[word] = max(count, counts.get(word, count))
+    words = list(counts)
+    # the most frequent first, the ties in the order of the list
+    order = sorted(range(len(words)), key=lambda index: -counts[words[index]])
+    ranks = array.array("I", [0] * len(words))
+    for rank, index in enumerate(order, 1):
+        ranks[index] = rank
+    offsets = array.array("I", [0])
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+    slot_count = 1 << max(len(words) * 2, 1).bit_length()
+    slots = array.array("I", [0] * slot_count)
+    for index, word in enumerate(words):
+        slot = slot_hash(word) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = index + 1
+    return (index_magic + len(words).to_bytes(4, sys.byteorder) + slot_count.to_bytes(4, sys.byteorder)
+            + offsets.tobytes() + ranks.tobytes() + slots.tobytes() + b"".join(words))
+
+
+class FrequencyTable:
+    """
+    The frequency rank of the words of a frequency list, compiled once into a
+    hash table on disk (see compile_frequencies) and memory-mapped: a word is
+    interned into its id with one or two probes, and its rank is read from
+    the array of ranks at that id, so each lookup is O(1) and nothing is
+    loaded into Python objects.
+    """
+
+    def __init__(self, path: str, folder: str = frequency_cache_dir):
+        self.path = path
+        self.map = compiled_index(path, folder, compile_frequencies)
+        header = len(index_magic)
+        self.size = int.from_bytes(self.map[header:header + 4], sys.byteorder)
+        self.slot_count = int.from_bytes(self.map[header + 4:header + 8], sys.byteorder)
+        view = memoryview(self.map)
+        start = header + 8
+        self.offsets = view[start:start + 4 * (self.size + 1)].cast("I")
+        start += 4 * (self.size + 1)
+        self.ranks = view[start:start + 4 * self.size].cast("I")
+        start += 4 * self.size
+        self.slots = view[start:start + 4 * self.slot_count].cast("I")
+        self.words_start = start + 4 * self.slot_count
+        # the same words come back in every paragraph; lru_cache is safe to share between threads
+        self.rank = functools.lru_cache(maxsize=1 << 16)(self.lookup_rank)
+
+    def __len__(self):
+        return self.size
+
+    def word(self, token_id: int) -> bytes:
+        return self.map[self.words_start + self.offsets[token_id]:self.words_start + self.offsets[token_id + 1]]
+
+    def token_id(self, word: str):
+        """The id of `word` in the table, None when it isn't there."""
+        target = normalize(word).encode("utf-8")
+        mask = self.slot_count - 1
+        slot = slot_hash(target) & mask
+        # at most half of the slots are used, so an empty one comes soon
+        while self.slots[slot]:
+            token_id = self.slots[slot] - 1
+            if self.word(token_id) == target:
+                return token_id
+            slot = (slot + 1) & mask
+        return None
+
+    def lookup_rank(self, word: str):
+        """The frequency rank of `word` (1 for the most frequent), None when it isn't in the table."""
+        token_id = self.token_id(word)
+        return None if token_id is None else self.ranks[token_id]
+
+
+class FrequentWords:
+    """
+    The words the repetitions leave out: the ones among the `max_rank` most
+    frequent of a FrequencyTable, plus the `extra` words. It takes the place
+    of the set of ignored words: `word in frequent` looks its rank up.
+    """
+
+    def __init__(self, table: FrequencyTable, max_rank: int = default_max_rank, extra=()):
+        self.table = table
+        self.max_rank = max_rank
+        self.extra = frozenset(word.lower() for word in extra)
+
+    def __contains__(self, word: str) -> bool:
+        if word in self.extra:
+            return True
+        rank = self.table.rank(word)
+        return rank is not None and rank <= self.max_rank
+
+
+def ignored_words(ignore_words):
+    """The words to ignore as something `in` can be asked to: a FrequentWords as it
+    is, any other collection of words lower-cased into a set."""
+    if isinstance(ignore_words, FrequentWords):
+        return ignore_words
+    return set(word.lower() for word in ignore_words or [])
+
+
+def load_frequencies(path: str = None):
+    """The FrequencyTable of `path`, or of default_frequencies when it's there (None when it isn't)."""
+    if path is None:
+        if not os.path.exists(default_frequencies):
+            return None
+        path = default_frequencies
+    return FrequencyTable(path)
+
+
+def count_corpus(paths, encoding: str = "utf-8") -> Counter:
+    """The lower-case words of the text files of a corpus and how many times each appears."""
+    counts = Counter()
+    for path in paths:
+        with open(path, encoding=encoding, errors="replace") as f:
+            for line in f:
+                counts.update(normalize(word) for word in word_pattern.findall(line) if not word.isdigit())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counts the words of a corpus of Spanish text files into the frequency list "
+                                                 "that decides which repetitions are worth flagging.")
+    parser.add_argument("corpus", nargs="+", help="text files of the corpus")
+    parser.add_argument("-o", "--output", default=default_frequencies, help="frequency list to write (default: frecuencias_es.txt)")
+    parser.add_argument("--top", type=int, default=50000, help="words to keep, the most frequent (default: 50000)")
+    parser.add_argument("--min-count", type=int, default=2, help="leave out the words seen fewer times (default: 2)")
+    args = parser.parse_args()
+
+    counts = count_corpus(args.corpus)
+    # the most frequent first, the ties in alphabetical order, so the list doesn't depend on the order of the files
+    ranked = sorted((item for item in counts.items() if item[1] >= args.min_count), key=lambda item: (-item[1], item[0]))[:args.top]
+    temporary = f"{args.output}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        for word, count in ranked:
+            f.write(f"{word} {count}\n")
+    os.replace(temporary, args.output)
+    print(f"{len(ranked)} words of {len(counts)} written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import random
+import sys
+
+from ai_phrasing import mark_ai_phrasing
+from prose import prose_category
+from references import CrossReferences
+from repetition import highlight_long_sentences, highlight_repeated_words, split_sentences
+from scaling import default_seeds, seed_growth, time_run
+from utils import SegmentView, fix_cite_usage, line_classifier, preprocess_lines
+
+# Pathological LaTeX: each generator returns about `size` units of one kind of
+# adversarial input, all of it on a single line unless said otherwise.
+generators = {
+    # $ and $$ that are never closed, and unclosed \( \[
+    "unclosed_math": lambda size, rng: " ".join(rng.choice(["$$x", "$y", r"\(z", r"\[w", "texto"]) for _ in range(size * 20)),
+    # \textbf{\textit{... nested without end
+    "deep_nesting": lambda size, rng: "".join(rng.choice([r"\textbf{", r"\textit{", r"\comment{", "{"]) + "a " for _ in range(size)) + "}" * size,
+    # one long line without spaces, punctuation or commands
+    "unbroken_line": lambda size, rng: "".join(rng.choice("abcdefghij") for _ in range(size * 100)),
+    # a long sentence that never ends, with commands that never start a new line
+    "endless_sentence": lambda size, rng: " ".join(rng.choice(["palabra", "otra", r"\ref{x}", "más"]) for _ in range(size * 10)),
+    # a minified table: cells and row ends with no line breaks
+    "minified_table": lambda size, rng: r"\begin{tabular}{ll}" + " ".join(f"c{i} & d{i} \\\\" for i in range(size * 5)) + r"\end{tabular}",
+    # \cite{ and \section{ that are never closed
+    "unclosed_commands": lambda size, rng: " ".join(rng.choice([r"a.\cite{k", r"\section{t", r"\ref{", "b"]) for _ in range(size * 5)),
+    # commands to consider and optional arguments left open or at the very end
+    "dangling_commands": lambda size, rng: " ".join(rng.choice([r"\textbf{a", r"\textcolor{red}", r"\comment{x}", r"\foo[", "b", "  "]) for _ in range(size * 5)) + r" \textbf  ",
+    # many inline comments and escaped percents, one per line
+    "comments": lambda size, rng: "\n".join(rng.choice(["a % b", r"50\% c % d", "%", r"\item x % y"]) for _ in range(size * 5)),
+}
+
+
+def reviewed_view(text):
+    view = SegmentView(text)
+    highlight_long_sentences(view, [], 40)
+    highlight_repeated_words(view, ['Green', 'Cerulean', 'red'], 200, ["el", "la"])
+    return view
+
+
+# name: (prepare the input, run the stage)
+stages = {
+    "preprocess": (lambda text: text, lambda text: list(preprocess_lines(text))),
+    "classify": (lambda text: text, line_classifier),
+    "cite_usage": (lambda text: text, fix_cite_usage),
+    "segment_view": (lambda text: text, SegmentView),
+    "preflight": (SegmentView, prose_category),
+    "sentences": (lambda text: text, split_sentences),
+    "long_sentence": (SegmentView, lambda view: highlight_long_sentences(view, [], 40)),
+    "repetition": (SegmentView, lambda view: highlight_repeated_words(view, ['Green', 'Cerulean', 'red'], 200, ["el", "la"])),
+    "ai_phrasing": (SegmentView, lambda view: mark_ai_phrasing(view, 0)),
+    "render": (reviewed_view, lambda view: view.render()),
+    "references": (lambda text: text.splitlines(), lambda lines: CrossReferences(lines, "", "fuzz.tex")),
+}
+
+# growth exponent allowed for every stage and input (1.0 is linear), checked on
+# the median of the seeds as in scaling.py
+default_bound = 1.3
+
+
+def run_case(generator, stage, size, repeat, seed):
+    text = generators[generator](size, random.Random(seed))
+    prepare, run = stages[stage]
+    return time_run(prepare, run, text, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times every stage of the review on pathological LaTeX and fails on superlinear growth (python fuzz.py).")
+    parser.add_argument("--generators", nargs="+", choices=list(generators), help="inputs to try (default: all)")
+    parser.add_argument("--stages", nargs="+", choices=list(stages), help="stages to time (default: all)")
+    parser.add_argument("--size", type=int, default=100, help="N: units of the smallest input, doubled three times (default: 100)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size, the best one is kept (default: 3)")
+    parser.add_argument("--bound", type=float, default=default_bound, help=f"growth exponent allowed (default: {default_bound})")
+    parser.add_argument("--seed", type=int, default=0, help="first seed of the generated inputs (default: 0)")
+    parser.add_argument("--seeds", type=int, default=default_seeds, help=f"seeds tried, the median exponent is checked (default: {default_seeds})")
+    args = parser.parse_args()
+
+    sizes = [args.size * factor for factor in (1, 2, 4, 8)]
+    seeds = range(args.seed, args.seed + args.seeds)
+    failed = []
+    print(f"{'input':<18} {'stage':<14} " + " ".join(f"{'N=' + str(size):>10}" for size in sizes) + f" {'exponent':>9} {'seeds':>11}")
+    for generator in args.generators or generators:
+        for stage in args.stages or stages:
+            try:
+                times, exponent, exponents = seed_growth(sizes, lambda size, seed: run_case(generator, stage, size, args.repeat, seed), seeds)
+            except Exception as e:
+                failed.append(f"{generator}/{stage}")
+                print(f"{generator:<18} {stage:<14} {type(e).__name__}: {e}  FAILED")
+                continue
+            status = "" if exponent <= args.bound else "  FAILED"
+            if status:
+                failed.append(f"{generator}/{stage}")
+            print(f"{generator:<18} {stage:<14} " + " ".join(f"{t * 1000:>8.2f}ms" for t in times)
+                  + f" {exponent:>9.2f} {min(exponents):>5.2f}-{max(exponents):<5.2f}{status}")
+
+    if failed:
+        print("Failed:", ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import random
+import re
+import sys
+
+from references import CrossReferences
+from scaling import make_sentence
+from utils import preprocess_lines
+
+# the regular expressions of the remove_inline_comments and format_latex_commands
+# that preprocess_lines replaced, kept here as the reference it must reproduce
+reference_comment_pattern = re.compile(r'(?<!\\)%')
+reference_command_pattern = re.compile(
+    r'(\S.*?)('
+    r'\\(?:begin|end)\{[a-zA-Z0-9*]+\}'
+    r'|\\(?:chapter|(?:sub)*section)\*?\{.*?\}'
+    r'|\\item'
+    r'|\\\[|\\\]'
+    r')'
+)
+
+# small inputs and the lines they must give, one per behaviour worth pinning down
+golden_cases = [
+    ("Texto % comentario", ["Texto"]),
+    ("Un 50\\% de los casos.", ["Un 50\\% de los casos."]),
+    ("% línea comentada \\section{A}", ["% línea comentada \\section{A}"]),
+    ("   % comentario con sangría", ["   % comentario con sangría"]),
+    ("Antes \\section{Título} después", ["Antes ", "\\section{Título}", " después"]),
+    ("Antes \\subsection*{Título}", ["Antes ", "\\subsection*{Título}", ""]),
+    ("\\section{Al principio} texto", ["\\section{Al principio} texto"]),
+    ("uno \\item dos \\item tres", ["uno ", "\\item dos ", "\\item tres"]),
+    ("a \\begin{figure*}b\\end{figure*}", ["a ", "\\begin{figure*}", "b", "\\end{figure*}", ""]),
+    ("x \\[ y \\] z", ["x ", "\\[", " y ", "\\]", " z"]),
+    ("Sin cerrar \\section{Título", ["Sin cerrar \\section{Título"]),
+    ("uno\n\ndos\n", ["uno", "", "dos"]),
+    # the trailing empty line is lost, as it was
+    ("uno\n\n", ["uno"]),
+    ("", [""]),
+]
+
+# lines of a body and the (rule, key) of the references that must not resolve in it
+golden_references = [
+    (["% Ver \\ref{viejo}", "Ver \\ref{nuevo}. % y \\ref{otro}"], [("undefined_reference", "nuevo")]),
+    (["\\section{A}\\label{sec:a}", "% \\label{sec:b}", "Ver \\ref{sec:a} y \\ref{sec:b}."], [("undefined_reference", "sec:b")]),
+    (["\\bibitem{uno}", "  % \\bibitem{dos}", "Según \\cite{uno,dos}, el 50\\% \\cite{tres}."],
+     [("missing_citation", "dos"), ("missing_citation", "tres")]),
+]
+
+# pieces of the random lines, the ones that have changed the output of the passes before
+line_pieces = [
+    "% nota", " % nota", "50\\%", "\\section{Sección}", "\\section*{Sin número}", "\\subsubsection{Otra}",
+    "\\chapter{Capítulo}", "\\section{Sin cerrar", "\\item", "\\begin{itemize}", "\\end{itemize}",
+    "\\begin{figure*}", "\\[", "\\]", "x^2", "{", "}", "  ", "",
+]
+
+
+def reference_lines(text: str):
+    """The lines of the document body the way the passes before preprocess_lines gave them."""
+    lines = []
+    for line in text.splitlines():
+        match = reference_comment_pattern.search(line)
+        if match and line[:match.start()].strip():
+            line = line[:match.start()].rstrip()
+        lines.append(line)
+    text = "\n".join(lines)
+
+    def replacer(match):
+        result = match.group(1) + "\n" + match.group(2)
+        return result if match.group(2).startswith("\\item") else result + "\n"
+
+    lines = [line if line.strip().startswith("%") else reference_command_pattern.sub(replacer, line)
+             for line in text.splitlines()]
+    return "\n".join(lines).split("\n")
+
+
+def make_line(rng):
+    parts = [make_sentence(rng) if rng.random() < 0.5 else rng.choice(line_pieces) for _ in range(rng.randint(0, 4))]
+    return rng.choice(["", " ", "  "]).join(parts)
+
+
+def first_difference(expected, found):
+    for index, (left, right) in enumerate(zip(expected, found)):
+        if left != right:
+            return index
+    return min(len(expected), len(found))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks utils.preprocess_lines against the passes it replaced, on small "
+                                                 "golden inputs and on a random body, and the references.CrossReferences "
+                                                 "of golden bodies (python golden.py).")
+    parser.add_argument("--lines", type=int, default=20000, help="lines of the random body (default: 20000)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failed = False
+    for text, expected in golden_cases:
+        found = list(preprocess_lines(text))
+        if found != expected or reference_lines(text) != expected:
+            failed = True
+            print(f"Golden input {text!r}: expected {expected!r}, got {found!r} (the reference gives {reference_lines(text)!r})")
+    for lines, expected in golden_references:
+        found = [(rule, key) for _, _, key, rule in CrossReferences(lines, "\n".join(lines), "golden.tex").misses]
+        if found != expected:
+            failed = True
+            print(f"Golden references {lines!r}: expected {expected!r}, got {found!r}")
+
+    rng = random.Random(args.seed)
+    text = "\n".join(make_line(rng) for _ in range(args.lines))
+    positions = []
+    expected = reference_lines(text)
+    found = list(preprocess_lines(text, positions))
+    if found != expected:
+        failed = True
+        index = first_difference(expected, found)
+        print(f"Random body, line {index + 1} of the output: expected {expected[index:index + 1]!r}, got {found[index:index + 1]!r}")
+    # each output line starts at its position in the source
+    source = text.splitlines()
+    for index, (line, (number, column)) in enumerate(zip(found, positions)):
+        if line and not source[number].startswith(line, column):
+            failed = True
+            print(f"Random body, line {index + 1} of the output isn't at line {number + 1}, column {column + 1} of the input")
+            break
+    if len(positions) != len(found):
+        failed = True
+        print(f"Random body: {len(found)} lines but {len(positions)} positions")
+
+    if failed:
+        sys.exit(1)
+    print(f"{len(golden_cases) + len(golden_references)} golden inputs and {args.lines} random lines ({len(found)} out) give the same lines as before")
+
+
+if __name__ == "__main__":
+    main()
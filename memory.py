@@ -0,0 +1,147 @@
+import gc
+import os
+import sys
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import utils
+
+# characters per spaCy Doc once the memory budget is exceeded
+constrained_doc_chars = 2000
+
+
+def current_rss() -> int:
+    """Resident set size of the process in bytes (the peak RSS where /proc isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes everywhere else
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_breakdown():
+    """(rss, shared, private) bytes of the process. The pages still shared with
+    other processes, like a forked worker's with its parent, are only told
+    apart on Linux; elsewhere all the RSS counts as private."""
+    try:
+        values = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+        private = values["Private_Clean"] + values["Private_Dirty"]
+        return values["Rss"], values["Rss"] - private, private
+    except (OSError, KeyError, ValueError):
+        rss = current_rss()
+        return rss, 0, rss
+
+
+def megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f}"
+
+
+class MemoryReport:
+    """
+    Measures the memory of each stage of a review and of each paragraph:
+    the peak and the retained (still allocated at the end) Python memory
+    according to tracemalloc, and the RSS of the process before and after.
+
+    With `max_memory` (bytes) the RSS is checked after every paragraph and,
+    once it goes over the budget, the review continues in constrained mode:
+    the cached pipelines of other modes are dropped and long paragraphs are
+    parsed in pieces of constrained_doc_chars characters. close() ends the
+    review: the pieces go back to their size and tracemalloc is stopped if
+    this report started it.
+    """
+
+    def __init__(self, enabled: bool = False, max_memory: int = None):
+        self.enabled = enabled
+        self.max_memory = max_memory
+        self.constrained = False
+        self.stages = []
+        self.paragraphs = []
+        self.open_peaks = []
+        self.previous_doc_chars = None  # utils.max_doc_chars before the constrained mode
+        self.started_tracing = enabled and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def _fold_peak(self):
+        """Keeps the peak of the open stages before tracemalloc's peak is reset by a nested one."""
+        peak = tracemalloc.get_traced_memory()[1]
+        self.open_peaks = [max(open_peak, peak) for open_peak in self.open_peaks]
+
+    @contextmanager
+    def _measure(self, records, name, **details):
+        if not self.enabled:
+            yield
+            return
+        self._fold_peak()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        rss_before = current_rss()
+        self.open_peaks.append(before)
+        try:
+            yield
+        finally:
+            self._fold_peak()
+            peak = self.open_peaks.pop()
+            after, _ = tracemalloc.get_traced_memory()
+            records.append(dict(name=name, peak=peak - before, retained=after - before,
+                                rss_before=rss_before, rss_after=current_rss(), **details))
+
+    def stage(self, name: str):
+        return self._measure(self.stages, name)
+
+    @contextmanager
+    def paragraph(self, line: int, size: int):
+        with self._measure(self.paragraphs, f"line {line}", size=size):
+            yield
+        self.check_budget()
+
+    def check_budget(self):
+        if self.max_memory is None or self.constrained:
+            return
+        if current_rss() > self.max_memory:
+            self.enter_constrained_mode()
+
+    def enter_constrained_mode(self):
+        self.constrained = True
+        self.previous_doc_chars = utils.max_doc_chars
+        utils.drop_nlp_caches()
+        utils.max_doc_chars = constrained_doc_chars
+        gc.collect()
+        print(f"Memory budget of {megabytes(self.max_memory)} MB exceeded, "
+              f"continuing in constrained mode (RSS {megabytes(current_rss())} MB)")
+
+    def close(self):
+        if self.constrained and utils.max_doc_chars == constrained_doc_chars:
+            utils.max_doc_chars = self.previous_doc_chars
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def print(self, top: int = 10):
+        if not self.enabled:
+            return
+        print(f"\n{'stage':<24} {'peak MB':>9} {'retained MB':>12} {'RSS before':>11} {'RSS after':>10}")
+        for record in self.stages:
+            print(f"{record['name']:<24} {megabytes(record['peak']):>9} {megabytes(record['retained']):>12} "
+                  f"{megabytes(record['rss_before']):>11} {megabytes(record['rss_after']):>10}")
+        if self.paragraphs:
+            print(f"\n{len(self.paragraphs)} paragraphs, the {min(top, len(self.paragraphs))} with the highest peak:")
+            print(f"{'paragraph':<24} {'chars':>9} {'peak MB':>9} {'retained MB':>12}")
+            for record in sorted(self.paragraphs, key=lambda r: r["peak"], reverse=True)[:top]:
+                print(f"{record['name']:<24} {record['size']:>9} {megabytes(record['peak']):>9} {megabytes(record['retained']):>12}")
+        if self.constrained:
+            print("The memory budget was exceeded and part of the review ran in constrained mode.")
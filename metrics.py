@@ -0,0 +1,183 @@
+import bisect
+import json
+import math
+import os
+import random
+import time
+
+# every exported metric starts with this
+prefix = "latex_review_"
+# upper bounds in seconds of the buckets of the Prometheus histograms
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+percentiles = (50, 90, 99)
+# observations kept of each histogram to compute the percentiles from
+reservoir_size = 1024
+
+help_texts = {
+    "files_total": "LaTeX files reviewed",
+    "paragraphs_total": "paragraphs reviewed, by outcome (full, lexicon_only, skipped, not_reviewed)",
+    "paragraph_categories_total": "paragraphs by kind according to the pre-flight filter (prose, table, code, urls, bibtex, math, short_layout, empty)",
+    "findings_total": "findings, by rule",
+    "parse_cache_total": "spaCy parses asked to the parse cache, by result (hit, miss)",
+    "parse_seconds": "time spent in spaCy (or reading its cached parses) for a piece of text",
+    "paragraph_seconds": "time to check a paragraph",
+    "file_seconds": "time to review a file",
+}
+
+
+def percentile(values, share: float) -> float:
+    """The nearest-rank percentile of the sorted `values`."""
+    index = max(math.ceil(share / 100 * len(values)) - 1, 0)
+    return values[index]
+
+
+def label_text(labels) -> str:
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}" if labels else ""
+
+
+class Histogram:
+    """
+    The observations of one metric and label set in bounded memory: how many
+    fell in each bucket, their sum and count, and a uniform sample of at most
+    reservoir_size of them (reservoir sampling) for the percentiles.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(buckets)  # per bucket, not cumulative; above the last one only in count
+        self.sum = 0.0
+        self.count = 0
+        self.sample = []
+        self.random = random.Random(0)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(buckets, value)
+        if index < len(buckets):
+            self.bucket_counts[index] += 1
+        self.sum += value
+        self.count += 1
+        if len(self.sample) < reservoir_size:
+            self.sample.append(value)
+        else:
+            slot = self.random.randrange(self.count)
+            if slot < reservoir_size:
+                self.sample[slot] = value
+
+    def merge(self, other: "Histogram"):
+        total = self.count + other.count
+        if len(self.sample) + len(other.sample) <= reservoir_size:
+            self.sample += other.sample
+        elif total:
+            # each side keeps a share of the reservoir in proportion to the observations it stands for
+            keep = min(round(reservoir_size * self.count / total), len(self.sample))
+            self.sample = (self.random.sample(self.sample, keep)
+                           + self.random.sample(other.sample, min(reservoir_size - keep, len(other.sample))))
+        self.bucket_counts = [mine + theirs for mine, theirs in zip(self.bucket_counts, other.bucket_counts)]
+        self.sum += other.sum
+        self.count = total
+
+    def cumulative_counts(self):
+        """The count of each bucket of the Prometheus histogram: the observations up to its bound."""
+        total = 0
+        for count in self.bucket_counts:
+            total += count
+            yield total
+
+
+class Metrics:
+    """
+    Counters and histograms of one or more reviews: files, paragraphs and
+    findings, the time spent in spaCy, the hits of the parse cache and the
+    latency of each paragraph and file, in memory that doesn't grow with the
+    observations (see Histogram). Exported as a Prometheus text file
+    (for the textfile collector of node_exporter) and as a JSON summary.
+    The metrics of workers are added up with merge.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {}  # (name, labels): value, labels as sorted (name, value) pairs
+        self.observations = {}  # (name, labels): Histogram of the seconds
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.observations:
+            self.observations[key] = Histogram()
+        self.observations[key].observe(seconds)
+
+    def merge(self, other: "Metrics"):
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, histogram in other.observations.items():
+            self.observations.setdefault(key, Histogram()).merge(histogram)
+
+    def total(self, name: str, **labels) -> float:
+        """The sum of the counter `name` over the label sets that include `labels`."""
+        return sum(value for (counter, counter_labels), value in self.counters.items()
+                   if counter == name and set(labels.items()) <= set(counter_labels))
+
+    def seconds(self, name: str) -> float:
+        """The seconds observed in `name` over every label set."""
+        return sum(histogram.sum for (observed, _), histogram in self.observations.items() if observed == name)
+
+    def sample(self, name: str):
+        """The sorted sample of the observations of `name` over every label set."""
+        return sorted(value for (observed, _), histogram in self.observations.items() if observed == name
+                      for value in histogram.sample)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            lines += [f"# HELP {prefix}{name} {help_texts.get(name, name)}", f"# TYPE {prefix}{name} counter"]
+            for (counter, labels), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f"{prefix}{name}{label_text(labels)} {value:g}")
+        for name in sorted({name for name, _ in self.observations}):
+            lines += [f"# HELP {prefix}{name} {help_texts.get(name, name)}", f"# TYPE {prefix}{name} histogram"]
+            for (observed, labels), histogram in sorted(self.observations.items(), key=lambda item: item[0]):
+                if observed != name:
+                    continue
+                for bound, count in zip(buckets, histogram.cumulative_counts()):
+                    lines.append(f"{prefix}{name}_bucket{label_text(labels + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{prefix}{name}_bucket{label_text(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{prefix}{name}_sum{label_text(labels)} {histogram.sum:.6f}")
+                lines.append(f"{prefix}{name}_count{label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        paragraphs = self.total("paragraphs_total")
+        parse_time = self.seconds("parse_seconds")
+        check_time = self.seconds("paragraph_seconds")
+        hits, misses = self.total("parse_cache_total", result="hit"), self.total("parse_cache_total", result="miss")
+        # from a sample once there are more than reservoir_size files
+        file_seconds = self.sample("file_seconds")
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "files": self.total("files_total"),
+            "paragraphs": paragraphs,
+            "paragraphs_per_second": round(paragraphs / elapsed, 3) if elapsed else None,
+            # share of the time checking paragraphs that went to spaCy
+            "spacy_time_share": round(parse_time / check_time, 3) if check_time else None,
+            "parse_cache_hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            "paragraph_outcomes": {dict(labels)["outcome"]: value for (name, labels), value in sorted(self.counters.items())
+                                   if name == "paragraphs_total"},
+            "paragraph_categories": {dict(labels)["category"]: value for (name, labels), value in sorted(self.counters.items())
+                                     if name == "paragraph_categories_total"},
+            "findings": {dict(labels)["rule"]: value for (name, labels), value in sorted(self.counters.items())
+                         if name == "findings_total"},
+            "file_seconds": {f"p{share}": round(percentile(file_seconds, share), 3) for share in percentiles} if file_seconds else {},
+        }
+
+    def write(self, prometheus_path: str = None, json_path: str = None):
+        # written to a temporary file and renamed, so a scraper never reads half a file
+        for path, content in ((prometheus_path, self.to_prometheus),
+                              (json_path, lambda: json.dumps(self.summary(), ensure_ascii=False, indent=2) + "\n")):
+            if path:
+                temporary = f"{path}.{os.getpid()}.tmp"
+                with open(temporary, "w", encoding="utf-8") as f:
+                    f.write(content())
+                os.replace(temporary, path)
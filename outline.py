@@ -0,0 +1,121 @@
+import bisect
+import re
+
+from utils import heading_title
+
+heading_levels = {"part": 0, "chapter": 1, "section": 2, "subsection": 3, "subsubsection": 4}
+heading_pattern = re.compile(r"^\s*\\(part|chapter|section|subsection|subsubsection)(\*?)\{")
+environment_pattern = re.compile(r"\\(begin|end)\{([^}]*)\}")
+
+
+class OutlineEntry:
+    """A heading and the lines it covers: from its own line up to the next heading of the same or a higher level."""
+
+    def __init__(self, kind: str, number, title: str, start: int):
+        self.kind = kind
+        self.level = heading_levels[kind]
+        self.number = number  # "3.2", or None for \section* and the like
+        self.title = title
+        self.start = start
+        self.end = None
+        self.environments = {}  # name: environments that start in its own lines
+        self.paragraphs = 0
+        self.seconds = 0.0
+
+    def contains(self, index: int) -> bool:
+        return self.start <= index < self.end
+
+    def label(self) -> str:
+        return f"{self.number} {self.title}" if self.number else self.title
+
+
+class Outline:
+    """
+    The chapters, sections and subsections of the body, numbered like LaTeX
+    would, with the range of lines (indices of `lines`) of each and the
+    environments that start in them, built in one pass over the lines.
+    """
+
+    def __init__(self, lines):
+        self.entries = []
+        self.environments = []  # (name, start, end) of every closed environment
+        counters = [0] * len(heading_levels)
+        open_entries = []  # the headings whose lines haven't ended, outermost first
+        open_environments = []
+        for index, line in enumerate(lines):
+            match = heading_pattern.match(line)
+            if match:
+                kind, starred = match.groups()
+                level = heading_levels[kind]
+                number = None
+                if not starred:
+                    counters[level] += 1
+                    counters[level + 1:] = [0] * (len(counters) - level - 1)
+                    # parts don't number what's inside them, an article has no chapters
+                    if level > 0:
+                        first = 1 if counters[1] else 2
+                        number = ".".join(str(counter) for counter in counters[first:level + 1])
+                    else:
+                        number = str(counters[0])
+                while open_entries and open_entries[-1].level >= level:
+                    open_entries.pop().end = index
+                self.entries.append(OutlineEntry(kind, number, heading_title(line), index))
+                open_entries.append(self.entries[-1])
+            for environment in environment_pattern.finditer(line):
+                command, name = environment.groups()
+                if command == "begin":
+                    open_environments.append((name, index))
+                    if self.entries:
+                        counts = self.entries[-1].environments
+                        counts[name] = counts.get(name, 0) + 1
+                else:
+                    # an \end without its \begin closes nothing
+                    for depth in range(len(open_environments) - 1, -1, -1):
+                        if open_environments[depth][0] == name:
+                            self.environments.append((name, open_environments[depth][1], index + 1))
+                            del open_environments[depth:]
+                            break
+        for entry in open_entries:
+            entry.end = len(lines)
+        self.starts = [entry.start for entry in self.entries]
+
+    def entry_at(self, index: int):
+        """The innermost heading whose lines include `index`, None before the first one."""
+        position = bisect.bisect_right(self.starts, index) - 1
+        return self.entries[position] if position >= 0 else None
+
+    def select(self, selector: str, kinds) -> OutlineEntry:
+        """The heading of one of `kinds` whose number is `selector`, or else whose title contains it."""
+        candidates = [entry for entry in self.entries if entry.kind in kinds]
+        for entry in candidates:
+            if entry.number == selector:
+                return entry
+        for entry in candidates:
+            if selector.lower() in entry.title.lower():
+                return entry
+        known = ", ".join(entry.label() for entry in candidates) or "none"
+        raise ValueError(f"No {'/'.join(kinds)} matches '{selector}'; the document has: {known}")
+
+    def add_time(self, index: int, seconds: float):
+        entry = self.entry_at(index)
+        if entry:
+            entry.paragraphs += 1
+            entry.seconds += seconds
+
+    def print(self, source_line=lambda index: index + 1):
+        """Prints the outline; `source_line` turns a line index into a line of the source file."""
+        print(f"\n{'heading':<56} {'lines':>13} {'paragraphs':>11} {'time (s)':>9}")
+        for entry in self.entries:
+            heading = ("  " * max(entry.level - 1, 0) + entry.label())[:56]
+            lines = f"{source_line(entry.start)}-{source_line(max(entry.end - 1, entry.start))}"
+            print(f"{heading:<56} {lines:>13} {entry.paragraphs:>11} {entry.seconds:>9.3f}")
+            if entry.environments:
+                print(" " * (2 * entry.level) + ", ".join(f"{name} {count}" for name, count in sorted(entry.environments.items())))
+
+
+heading_names = {"part": "la parte", "chapter": "el capítulo", "section": "la sección",
+                 "subsection": "la subsección", "subsubsection": "la subsubsección"}
+
+
+def outline_note(entry: OutlineEntry) -> str:
+    return f"\n\\notaparaelautor{{Solo se revisó {heading_names[entry.kind]} {entry.label()}. El resto no se volvió a revisar.}}\n"
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+import spacy
+from spacy.tokens import DocBin
+
+# serialized Docs, one DocBin per parsed text
+parse_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "docs")
+default_max_size = 256 * 1024 * 1024
+# when the cache goes over its size the least recently used entries are removed
+# until it's down to this share of it, so the folder isn't listed on every parse
+evict_to_share = 0.8
+# a temporary file this old was left by a review killed while writing it
+stale_temporary_seconds = 3600
+
+
+@contextmanager
+def alarm_held():
+    """Holds SIGALRM back inside the block (the time budget of analysis.time_limit
+    is delivered right after it), so an entry is never left half written."""
+    if not hasattr(signal, "pthread_sigmask"):
+        yield
+        return
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+def pipeline_signature(pipeline) -> str:
+    """What a parse depends on besides the text: the model, its version and the enabled pipes."""
+    meta = pipeline.meta
+    return "\n".join([spacy.__version__, meta.get("lang", ""), meta.get("name", ""), meta.get("version", ""),
+                      ",".join(pipeline.pipe_names)])
+
+
+class ParseCache:
+    """
+    The spaCy Docs of the texts parsed before, stored on disk as DocBin
+    entries keyed by the hash of the text and the pipeline signature. The
+    parse only depends on them, so changing a checker, a threshold or a
+    word list reuses every parse. At most max_size bytes are kept. It can
+    be shared by threads: the counters and the size are updated under
+    `lock` and each thread writes its own temporary files; the calls into
+    the pipeline are up to the caller to serialize.
+    """
+
+    def __init__(self, folder: str = parse_cache_dir, max_size: int = default_max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.size = None  # bytes in the folder, counted the first time something is stored
+        self.signatures = {}  # id of the pipeline: (pipeline, signature)
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def signature(self, pipeline) -> str:
+        if id(pipeline) not in self.signatures:
+            # the pipeline is kept so its id isn't reused by another one
+            self.signatures[id(pipeline)] = (pipeline, pipeline_signature(pipeline))
+        return self.signatures[id(pipeline)][1]
+
+    def path(self, pipeline, text: str) -> str:
+        key = hashlib.sha256((self.signature(pipeline) + "\0" + text).encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, key + ".spacy")
+
+    def parse(self, pipeline, text: str):
+        """The Doc of `text`, from the cache or parsed with `pipeline` and stored."""
+        path = self.path(pipeline, text)
+        try:
+            with open(path, "rb") as f:
+                docs = list(DocBin().from_bytes(f.read()).get_docs(pipeline.vocab))
+            os.utime(path)  # recently used
+            with self.lock:
+                self.hits += 1
+            return docs[0]
+        except (OSError, ValueError, IndexError):
+            pass
+        with self.lock:
+            self.misses += 1
+        doc = pipeline(text)
+        self.store(path, DocBin(docs=[doc]).to_bytes())
+        return doc
+
+    def store(self, path: str, data: bytes):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with self.lock:
+                if self.size is None:
+                    self.remove_stale_temporaries()
+                    self.size = sum(entry.stat().st_size for entry in os.scandir(self.folder) if entry.is_file())
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with alarm_held():
+                with open(temporary, "wb") as f:
+                    f.write(data)
+                os.replace(temporary, path)
+            with self.lock:
+                self.size += len(data)
+                if self.size > self.max_size:
+                    self.evict()
+        except OSError:
+            pass  # the cache is optional
+
+    def remove_stale_temporaries(self):
+        stale = time.time() - stale_temporary_seconds
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.name.endswith(".tmp") and entry.stat().st_mtime < stale:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def evict(self):
+        self.remove_stale_temporaries()
+        entries = sorted((entry for entry in os.scandir(self.folder) if entry.name.endswith(".spacy")),
+                         key=lambda entry: entry.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= self.max_size * evict_to_share:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.size -= size
+            except OSError:
+                pass
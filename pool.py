@@ -0,0 +1,123 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import time
+
+from memory import megabytes, memory_breakdown
+from metrics import Metrics
+from pre_processing import process_tex_file
+from utils import nlp_modes, passive_voice_rules, person_rules, rule_matcher, set_nlp_mode
+
+# what the worker measured when it started: seconds from the creation of the
+# pool and its private memory at that point
+worker = {}
+
+
+def preload(mode: str):
+    """Loads the pipeline of `mode`, compiles the Matcher rules and parses once, so nothing is left to load lazily."""
+    pipeline = set_nlp_mode(mode)
+    for rules in (passive_voice_rules, person_rules):
+        rule_matcher(pipeline.vocab, rules)
+    pipeline("Texto de prueba.")
+    return pipeline
+
+
+def start_worker(mode: str, created: float, fork: bool):
+    if not fork:
+        preload(mode)  # a spawned worker loads its own copy of everything
+    worker["startup"] = time.monotonic() - created
+    worker["private"] = memory_breakdown()[2]
+
+
+def review(task):
+    """Reviews one file in a worker; returns its time, its errors and warnings, its metrics and the memory of the worker after it."""
+    file_path, output_tex, annotations_path, options = task
+    start = time.monotonic()
+    metrics = Metrics()
+    log = []
+    process_tex_file(file_path, output_tex, annotations_path, metrics=metrics, log=log.append, **options)
+    rss, shared, private = memory_breakdown()
+    # the names of the files written aren't worth repeating for every file
+    errors = [line for line in log if line.startswith("Error")]
+    warnings = [line for line in log if line.startswith("Warning")]
+    return dict(file=file_path, pid=os.getpid(), time=time.monotonic() - start, startup=worker["startup"],
+                start_private=worker["private"], rss=rss, shared=shared, private=private, errors=errors, warnings=warnings,
+                metrics=metrics)
+
+
+class ReviewPool:
+    """
+    Reviews many files at once in `workers` processes. With `fork` the parent
+    loads the pipeline and the lexicons once and forks the workers, which
+    share that memory copy-on-write and start without loading anything;
+    otherwise every worker is spawned and loads its own copy, as a plain
+    process pool would.
+    """
+
+    def __init__(self, workers: int, mode: str = "accurate", fork: bool = True):
+        self.mode = mode
+        start = time.monotonic()
+        if fork:
+            preload(mode)
+            # the collector would touch every object of the model and copy the pages it's in
+            gc.freeze()
+        self.load_time = time.monotonic() - start
+        self.parent_rss = memory_breakdown()[0]
+        context = multiprocessing.get_context("fork" if fork else "spawn")
+        self.pool = context.Pool(workers, start_worker, (mode, time.monotonic(), fork))
+
+    def review(self, tasks, **options):
+        """Reviews the (file, output .tex, annotations path or None) of `tasks`; yields each result as it's done."""
+        options["mode"] = self.mode
+        return self.pool.imap_unordered(review, [task + (options,) for task in tasks])
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reviews several LaTeX files in a pool of workers that share the loaded model.")
+    parser.add_argument("files", nargs="+", help="LaTeX files to review")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes of the pool (default: one per CPU)")
+    parser.add_argument("--mode", choices=nlp_modes, default="accurate")
+    parser.add_argument("--output-dir", default="revisados", help="folder of the annotated files (default: revisados)")
+    parser.add_argument("--annotations", action="store_true", help="also write the findings of each file as JSON Lines")
+    parser.add_argument("--lint-only", action="store_true", help="only write the findings (implies --annotations)")
+    parser.add_argument("--spawn", action="store_true", help="spawn workers that load their own model, to compare")
+    parser.add_argument("--metrics", metavar="PATH", help="write the counters and timings of all the reviews to PATH in the Prometheus text format")
+    parser.add_argument("--metrics-json", metavar="PATH", help="write a JSON summary of the counters and timings to PATH")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    tasks = []
+    for file_path in args.files:
+        base = os.path.join(args.output_dir, os.path.splitext(os.path.basename(file_path))[0] + "-revisado")
+        annotations = base + ".jsonl" if args.annotations or args.lint_only else None
+        tasks.append((file_path, base + ".tex", annotations))
+
+    pool = ReviewPool(args.workers, args.mode, fork=not args.spawn)
+    print(f"Parent: model loaded in {pool.load_time:.2f} s, RSS {megabytes(pool.parent_rss)} MB")
+    print(f"\n{'file':<32} {'pid':>7} {'time (s)':>9} {'RSS MB':>8} {'shared MB':>10} {'private MB':>11}")
+    workers = {}
+    metrics = Metrics()
+    for result in pool.review(tasks, lint_only=args.lint_only):
+        workers.setdefault(result["pid"], []).append(result)
+        metrics.merge(result["metrics"])
+        print(f"{result['file'][-32:]:<32} {result['pid']:>7} {result['time']:>9.2f} {megabytes(result['rss']):>8} "
+              f"{megabytes(result['shared']):>10} {megabytes(result['private']):>11}")
+        for message in result["errors"] + result["warnings"]:
+            print("   ", message)
+    pool.close()
+    metrics.write(args.metrics, args.metrics_json)
+
+    print(f"\n{'worker':<8} {'reviews':>8} {'startup (s)':>12} {'private at start MB':>20} {'max private MB':>15}")
+    for pid, results in sorted(workers.items()):
+        last = results[-1]
+        print(f"{pid:<8} {len(results):>8} {last['startup']:>12.2f} {megabytes(last['start_private']):>20} "
+              f"{megabytes(max(result['private'] for result in results)):>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
+import argparse
 from datetime import datetime
 import os
 import re
 import spacy
 import sys
-
-from repetition import process_latex_paragraph, process_latex_paragraph1
-from utils import LineType, NoteType, add_note, check_number, fix_cite_usage, format_latex_commands, get_begin_end_block, get_math_block, line_classifier, merge_dicts_by_start_order, process_section_chapter_declaration, remove_inline_comments, sanitize_preamble, separate_latex_commands
-from utils import mark_first_second_person, mark_passive_voice, mark_weasel_spanglish
+import time
+
+import utils
+from analysis import Analyzer, degraded_note, rule_names
+from annotations import Annotations, ParagraphPositions
+from changes import ChangedLines, since_note
+from compact import CompactNotes
+from frequency import FrequentWords, default_max_rank, load_frequencies
+from memory import MemoryReport
+from metrics import Metrics
+from outline import Outline, outline_note
+from parse_cache import ParseCache, default_max_size
+from references import CrossReferences, messages, print_warning, reference_note
+from spelling import document_glossary, load_dictionary, read_glossary
+from repetition import process_latex_paragraph, render_paragraph
+from utils import LineType, NoteType, add_note, check_number, get_begin_end_block, get_math_block, heading_title, line_classifier, nlp_modes, parse_chunks, preprocess_lines, process_section_chapter_declaration, sanitize_preamble, set_nlp_mode
+from word_index import WordIndex
 
 
 ###############################################
@@ -78,9 +92,56 @@ ignore_for_repetition = [
 ]
 
 amount_of_comments_for_new_page = 25
-
-def process_tex_file():
-    """Processes a LaTeX file to find errors in its writing."""
+# seconds the checkers may spend on a paragraph before it falls back to the lexicon checkers
+default_time_budget = 10
+
+def process_tex_file(file_path, output_tex, annotations_path=None, lint_only=False, mode="accurate", memory_report=False, max_memory=None, overuse=False, rules=None, compact=False, deterministic=False, since=None, parse_cache_size=0, time_budget=default_time_budget, metrics=None, preflight=True,
+                     section=None, chapter=None, print_outline=False, reviewer=None, dictionary=None, glossary=None,
+                     frequencies=None, frequent_rank=default_max_rank, log=None):
+    """Processes a LaTeX file to find errors in its writing.
+
+    If `annotations_path` is given every finding is also written there as JSON Lines.
+    With `lint_only` the findings are collected but the annotated .tex is not rendered.
+    `mode` selects the spaCy pipeline: "accurate" (the whole model) or "fast".
+    `memory_report` prints the peak and retained memory of each stage and paragraph,
+    and `max_memory` (bytes) switches to a constrained mode when the RSS goes over it.
+    With `overuse` the lemmas of the whole document are indexed and every chapter
+    with overused words gets a \\notaparaelautor summary under its heading.
+    `rules` limits the review to those checkers (see analysis.rule_names).
+    `compact` writes the lighter output that compiles faster (see compact.CompactNotes).
+    `deterministic` guarantees that the same input gives byte-identical files, so it
+    refuses `max_memory`: when the constrained mode starts depends on the memory in use.
+    With `since` (a git revision) only the paragraphs and headings with lines changed
+    since then are reviewed; the rest is written as it is. It can't be used with
+    `overuse`, which needs every paragraph.
+    With `parse_cache_size` the parses are kept in an on-disk cache of at most that
+    many bytes (off by default, see parse_cache.ParseCache).
+    Each paragraph is checked in at most `time_budget` seconds (0 or None for no
+    limit, ignored in the `deterministic` mode); one that goes over it or makes a
+    checker fail is only checked against the lexicons, or left as it is, with a
+    note that says so.
+    With `metrics` (a metrics.Metrics) the counts and times of the review are added to it.
+    With `preflight` the paragraphs that aren't prose skip the NLP checkers (see prose.prose_category).
+    `section` or `chapter` (a number like "3.2" or part of the title) limits the review
+    to that part of the outline the same way `since` does; then, or with `print_outline`,
+    the outline is printed with the time spent in each part (see outline.Outline).
+    With a `reviewer` (a reviewer.Reviewer) its pipeline, parse cache and lexicons are
+    used instead of the ones of the modules, which are left alone (`mode` and
+    `parse_cache_size` are ignored); the errors are raised instead of printed, the
+    warnings and the names of the files written go to its logger instead of the
+    output, the outline isn't printed and the Annotations are returned even without
+    an `annotations_path`.
+    The spelling is checked against the wordlist `dictionary` (by default
+    spelling.default_dictionary, when it's installed; see spelling.SpellingDictionary),
+    and the words of the `glossary` file and of the acronyms and glossary entries
+    of the document are taken as right.
+    The repetitions leave out the `frequent_rank` most frequent words of the
+    frequency list `frequencies` (by default frequency.default_frequencies, when
+    it's there; see frequency.FrequencyTable), or without one the words of
+    ignore_for_repetition.
+    With `log` (a function of one line) the warnings, the errors and the names of
+    the files written are passed to it instead of printed.
+    """
 
     # try:
     #     file_path = sys.argv[1]
@@ -118,27 +179,70 @@ def process_tex_file():
 
 
 
-    file_path = "ejemplo1.tex"
-    output_tex = "Dario.tex"
-
-
+    if deterministic and max_memory:
+        raise ValueError("The deterministic mode can't use a memory budget")
+    if since and overuse:
+        raise ValueError("The overuse summary needs the whole document, it can't be limited to the changes")
+    if section and chapter:
+        raise ValueError("Choose either a section or a chapter")
+    if (section or chapter) and overuse:
+        raise ValueError("The overuse summary needs the whole document, it can't be limited to a section")
+    started = time.monotonic()
+    if reviewer:
+        pipeline, parse_cache, parser = reviewer.pipeline, reviewer.parse_cache, reviewer.parse_chunks
+        weasel_words, spanglish_words, ignore_words = reviewer.weasels, reviewer.spanglish, reviewer.ignore_words
+        spelling_dictionary, glossary_words = reviewer.dictionary, reviewer.glossary
+        matchers, warn, report = reviewer.matchers, reviewer.logger.warning, reviewer.logger.info
+    else:
+        pipeline = set_nlp_mode(mode)
+        parse_cache = utils.parse_cache = ParseCache(max_size=parse_cache_size) if parse_cache_size else None
+        utils.metrics = metrics
+        parser = parse_chunks
+        frequency_table = load_frequencies(frequencies)
+        ignore_words = FrequentWords(frequency_table, frequent_rank) if frequency_table else ignore_for_repetition
+        weasel_words, spanglish_words = weasels, spanglish
+        spelling_dictionary = load_dictionary(dictionary) if rules is None or "spelling" in rules else None
+        glossary_words = read_glossary(glossary) if glossary else set()
+        report = log or print
+        warn = print_warning if log is None else lambda message: log(f"Warning: {message}")
+        matchers = None
+    if rules and "spelling" in rules and spelling_dictionary is None:
+        warn("there's no Spanish wordlist to check the spelling against, give one with --dictionary")
     new_tex = ""
+    annotations = Annotations(file_path) if annotations_path or reviewer else None
+    memory = MemoryReport(memory_report, max_memory)
+    word_index = WordIndex(ignore_words) if overuse else None
+    # how long a paragraph takes depends on the machine, so the deterministic mode has no budget
+    analyzer = Analyzer(rules, weasel_words, spanglish_words, ignore_words, fix_citations=not lint_only, compact=compact,
+                        time_budget=None if deterministic else time_budget, preflight=preflight, parser=parser,
+                        dictionary=spelling_dictionary, glossary=glossary_words, matchers=matchers)
+    compact_notes = CompactNotes() if compact else None
+    chapter_heads = []  # position in new_tex after each chapter heading
 
 
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
 
-            tex_content = file.read().strip()
+            with memory.stage("read"):
+                raw_content = file.read()
+                tex_content = raw_content.strip()
 
             my_commands = [r"\usepackage[dvipsnames]{xcolor}",r"\input{word-comments.tex}"]
 
             doc_pattern = re.compile(r"(\\begin\{document\})(.*?)(\\end\{document\})", re.DOTALL)
             match = doc_pattern.search(tex_content)
             if not match:
-                print("Error: Couldn't find both \\begin{document} and \\end{document} in the file.")
-                sys.exit(1)
+                if reviewer:
+                    raise ValueError(f"Couldn't find both \\begin{{document}} and \\end{{document}} in '{file_path}'")
+                report("Error: Couldn't find both \\begin{document} and \\end{document} in the file.")
+                # with a `log` the caller goes on with other files
+                if log is None:
+                    sys.exit(1)
+                return None
 
             preamble = tex_content[:match.start(1)]
+            if spelling_dictionary:
+                analyzer.known_words |= document_glossary(tex_content)
             doc_begin = match.group(1)
             doc_content = match.group(2)
             doc_end = match.group(3)
@@ -149,97 +253,349 @@ def process_tex_file():
             if conflict:
                 new_tex += "\n\\notaparaelautor{Algunos comandos antes de begin{document} fueron comentados por posibles conflictos}" + "\n"
 
-            doc_content = remove_inline_comments(doc_content)
-            doc_content = format_latex_commands(doc_content)
-            # Now properly split into lines
-            lines = doc_content.split('\n')  # Split on newlines
-            lines = [line.rstrip('\n') for line in lines]  # Remove any trailing newlines
+            # line and column of the source file where the body starts, for the annotations
+            body_prefix = raw_content[:len(raw_content) - len(raw_content.lstrip())] + tex_content[:match.start(2)]
+            body_line = body_prefix.count('\n') + 1
+            body_column = len(body_prefix) - body_prefix.rfind('\n')
+
+            # Inline comments removed and commands on their own lines, in one pass
+            positions = []
+            with memory.stage("preprocess"):
+                lines = list(preprocess_lines(doc_content, positions))
+
+            changes = ChangedLines(file_path, since) if since else None
+            outline = Outline(lines) if section or chapter or print_outline else None
+            selected = None
+            if section:
+                selected = outline.select(section, ("section", "subsection", "subsubsection"))
+            elif chapter:
+                selected = outline.select(chapter, ("part", "chapter"))
+            reviewed = total_paragraphs = 0
+
+            references = None
+            if "references" in analyzer.rules:
+                with memory.stage("references"):
+                    references = CrossReferences(lines, tex_content, file_path, warn)
             
-            total_lines = len(lines)
-            i = 0
-            first_paragraph_flag = 0
-
-            while i < total_lines:
-                line = lines[i]
+            with memory.stage("review"):
+                total_lines = len(lines)
+                i = 0
+                first_paragraph_flag = 0
+
+                while i < total_lines:
+                    line = lines[i]
+                    if references:
+                        # the references that don't resolve in what was just written
+                        new_tex += review_references(references.misses_before(i), annotations, positions, body_line, body_column, changes, metrics, selected)
                 
-                if not line.strip():  # Skip empty lines
-                    i += 1
-                    new_tex += "\n"
-                    continue
+                    if not line.strip():  # Skip empty lines
+                        i += 1
+                        new_tex += "\n"
+                        continue
                 
-                line_type = line_classifier(line)
-
-                # Print results based on classification
-                if line_type is LineType.SECTION or line_type is LineType.CHAPTER:
-                    line = process_section_chapter_declaration(lines, i,weasels, spanglish)
-                    if not first_paragraph_flag and  "section" in line:
-                        first_paragraph_flag = 1
-                        note = add_note(NoteType.CHAPTER_MISSING_INTRO, "")
-                        new_tex += note + line + "\n"
-                    else:   
+                    line_type = line_classifier(line)
+                    if compact_notes and line_type is LineType.CHAPTER:
+                        # the notes of the previous chapter that didn't fit in the margins
+                        new_tex += compact_notes.chapter_summary()
+
+                    # Print results based on classification
+                    if line_type is LineType.CHAPTER and annotations:
+                        annotations.start_chapter(heading_title(line))
+                    if word_index and line_type is LineType.CHAPTER:
+                        word_index.start_chapter(heading_title(line))
+                    elif word_index and line_type is LineType.SECTION:
+                        word_index.start_section(heading_title(line))
+                    source_line = source_position(positions[i], body_line, body_column)[0]
+                    # headings that aren't checked, or didn't change since the revision, are written as they are
+                    heading_skipped = ("headings" not in analyzer.rules or (changes and not changes.touches(source_line, source_line))
+                                       or (selected and not selected.contains(i)))
+                    if (line_type is LineType.SECTION or line_type is LineType.CHAPTER) and heading_skipped:
+                        new_tex += line + "\n"
+                        if line_type is LineType.CHAPTER:
+                            chapter_heads.append(len(new_tex))
+                    elif line_type is LineType.SECTION or line_type is LineType.CHAPTER:
+                        try:
+                            line = process_section_chapter_declaration(lines, i, weasel_words, spanglish_words, pipeline)
+                        except Exception as e:
+                            warn(f"the heading in line {source_line} couldn't be checked ({type(e).__name__})")
+                            new_tex += "\\notaparaelautor{La revisión de este título falló; no se revisó.}\n"
+                        if not first_paragraph_flag and  "section" in line:
+                            first_paragraph_flag = 1
+                            note = add_note(NoteType.CHAPTER_MISSING_INTRO, "")
+                            new_tex += note + line + "\n"
+                        else:   
+                            new_tex += line + "\n"
+                        if line_type is LineType.CHAPTER:
+                            chapter_heads.append(len(new_tex))
+                    elif line_type is LineType.COMMAND or line_type is LineType.IMAGE or line_type is LineType.COMMENT or line_type is LineType.BEGIN_BLOCK_START_END:
                         new_tex += line + "\n"
-                elif line_type is LineType.COMMAND or line_type is LineType.IMAGE or line_type is LineType.COMMENT or line_type is LineType.BEGIN_BLOCK_START_END:
-                    new_tex += line + "\n"
-                elif line_type is LineType.PARAGRAPH:
-                    # if it is classified as a paragraph then check the following lines to determine its extension
-                    # it will be considered part of the same text until the line reached is blank or starts with \item or \colchunk
-                    first_paragraph_flag = 1
-                    while i < total_lines-1:
-                        next_line = lines[i+1]
-                        if len(next_line) > 0 and not next_line.startswith(r'\item') and not next_line.startswith(r'\colchunk'):
-                            i +=1
-                            line += " " + next_line
-                        else:
-                            break
-                    line = fix_cite_usage(line)
-                    to_ignore, to_analyze = separate_latex_commands(line)
-                    for key, value in to_analyze.items():
-                        # dentro de estos métodos vamos a aumentar el contador de comments
-                        to_analyze[key], comments = mark_passive_voice(to_analyze[key], comments)
-                        to_analyze[key], comments = mark_first_second_person(to_analyze[key], comments) # Separar cuando se encuentra 1ra, 2da persona o adjetivo
-                        to_analyze[key], comments = mark_weasel_spanglish(weasels, spanglish, to_analyze[key], comments)
-
-
-                    
-                    line = merge_dicts_by_start_order(to_ignore, to_analyze)
-                    # this method is not considering repeated words inside a comment when it should
-                    p = process_latex_paragraph1(line, ignore_for_repetition)
-                    # si en este punto los comments superan la cantidad por página entonces agregamos \newpage
-                    new_tex += p + "\n"
-                    if comments >= amount_of_comments_for_new_page:
-                        new_tex += "\n\\notaparaelautor{Salto de línea para tener espacio para los comentarios.}\n\\newpage\n"
-                        comments = 0
-                else: # the line is the beginning of a block that doesn't need revision
-                    block = ""
-                    if "\\begin" in line:
-                        # Detect begin blocks
-                        block, i = get_begin_end_block(lines, i)
-                    if line == "\[":
-                        block, i = get_math_block(lines, i)
-                    new_tex += block + "\n"
-                i += 1
-            # new_tex = check_ambiguity_and_transitions(new_tex)
-            new_tex_content = new_preamble + doc_begin + new_tex + doc_end + post_doc
-            with open(output_tex, "w", encoding="utf-8") as f:
-                f.write(new_tex_content)
-
-            print("Modified file saved as:", output_tex)
+                    elif line_type is LineType.PARAGRAPH:
+                        # if it is classified as a paragraph then check the following lines to determine its extension
+                        # it will be considered part of the same text until the line reached is blank or starts with \item or \colchunk
+                        first_paragraph_flag = 1
+                        first_line = i
+                        line, paragraph, i = join_paragraph(lines, i, positions, body_line, body_column)
+                        total_paragraphs += 1
+                        if ((changes and not changes.touches(paragraph.positions[0][0], paragraph.positions[-1][0]))
+                                or (selected and not selected.contains(first_line))):
+                            # not changed since the revision, or out of the selected section: written as it is
+                            if metrics:
+                                metrics.count("paragraphs_total", outcome="not_reviewed")
+                            if not lint_only:
+                                new_tex += line + "\n"
+                            i += 1
+                            continue
+                        reviewed += 1
+                        with memory.paragraph(paragraph.positions[0][0], len(line)):
+                            if annotations and "cite_usage" in analyzer.rules:
+                                annotations.add_citations(line, paragraph)
+                            # dentro de los checkers vamos a aumentar el contador de comments
+                            paragraph_started = time.monotonic()
+                            analyzed, comments = analyzer.analyze(line, comments)
+                            if metrics:
+                                count_paragraph(metrics, analyzed, time.monotonic() - paragraph_started)
+                            if outline:
+                                outline.add_time(first_line, time.monotonic() - paragraph_started)
+                            if analyzed.degraded:
+                                warn(f"{analyzed.degraded} (line {paragraph.positions[0][0]})")
+                                if annotations:
+                                    annotations.add("degraded", paragraph.locate(0), paragraph.locate(len(line)), line, analyzed.degraded)
+                            if annotations and not analyzed.skipped:
+                                annotations.add_paragraph(analyzed.view, paragraph, analyzed.edits)
+                            # the parse of a degraded paragraph is what failed or took too long,
+                            # and one that isn't prose has no words to count
+                            if word_index and not analyzed.degraded and analyzed.category in (None, "prose"):
+                                word_index.add_paragraph(analyzed.get("docs"))
+                        if lint_only:
+                            # nothing is rendered in lint-only mode
+                            i += 1
+                            continue
+                        if analyzed.degraded:
+                            new_tex += degraded_note(analyzed)
+                        if analyzed.skipped:
+                            new_tex += line + "\n"
+                            i += 1
+                            continue
+                        if compact_notes:
+                            compact_notes.add_paragraph(analyzed.view, analyzed.get("sentences"))
+                        # si en este punto los comments superan la cantidad por página entonces agregamos \newpage
+                        new_tex += render_paragraph(analyzed.view) + "\n"
+                        if comments >= amount_of_comments_for_new_page and not compact_notes:
+                            new_tex += "\n\\notaparaelautor{Salto de línea para tener espacio para los comentarios.}\n\\newpage\n"
+                            comments = 0
+                    else: # the line is the beginning of a block that doesn't need revision
+                        block, i = skip_block(lines, i)
+                        new_tex += block + "\n"
+                    i += 1
+                if references:
+                    new_tex += review_references(references.misses_before(total_lines), annotations, positions, body_line, body_column, changes, metrics, selected)
+                if compact_notes:
+                    new_tex += compact_notes.chapter_summary()
+            if word_index:
+                with memory.stage("overuse"):
+                    chapter_overuse, section_overuse = word_index.overuse()
+                    if annotations:
+                        for chapter_id, lemmas in chapter_overuse.items():
+                            annotations.add_overuse("chapter", word_index.chapters[chapter_id], lemmas)
+                        for section_id, lemmas in section_overuse.items():
+                            annotations.add_overuse("section", word_index.sections[section_id], lemmas)
+                    new_tex = insert_chapter_notes(new_tex, chapter_heads, word_index.chapter_notes(chapter_overuse))
+            if changes:
+                new_tex = since_note(since, reviewed, total_paragraphs) + new_tex
+                if annotations:
+                    annotations.add_since(since, reviewed, total_paragraphs)
+            if selected:
+                new_tex = outline_note(selected) + new_tex
+            with memory.stage("write"):
+                if annotations_path:
+                    annotations.write(annotations_path)
+                    report(f"Annotations saved as: {annotations_path}")
+                if not lint_only:
+                    # new_tex = check_ambiguity_and_transitions(new_tex)
+                    new_tex_content = new_preamble + doc_begin + new_tex + doc_end + post_doc
+                    with open(output_tex, "w", encoding="utf-8") as f:
+                        f.write(new_tex_content)
+
+                    report(f"Modified file saved as: {output_tex}")
+            if metrics:
+                metrics.count("files_total")
+                metrics.observe("file_seconds", time.monotonic() - started)
+                if parse_cache:
+                    metrics.count("parse_cache_total", parse_cache.hits, result="hit")
+                    metrics.count("parse_cache_total", parse_cache.misses, result="miss")
+            not_prose = {category: count for category, count in analyzer.categories.items() if category != "prose"}
+            if not_prose:
+                report("Paragraphs that aren't prose, not analyzed with spaCy: " +
+                      ", ".join(f"{category} {count}" for category, count in sorted(not_prose.items())))
+            if parse_cache:
+                report(f"Parses reused from the cache: {parse_cache.hits} of {parse_cache.hits + parse_cache.misses}")
+            if outline and (selected or print_outline) and not reviewer:
+                outline.print(lambda index: source_position(positions[index], body_line, body_column)[0])
+            memory.print()
+            return annotations
 
 
 
                 
     
     except FileNotFoundError:
-        print(f"Error: File '{file_path}' not found.")
+        if reviewer:
+            raise
+        report(f"Error: File '{file_path}' not found.")
     except Exception as e:
-        print(f"Error processing file: {e}")
-
-
-process_tex_file()
-
-# Example usage
-# if __name__ == "__main__":  # Replace with your .tex file path
-#     process_tex_file()
+        if reviewer:
+            raise
+        report(f"Error processing file: {e}")
+    finally:
+        memory.close()
+
+
+def count_paragraph(metrics, analyzed, seconds):
+    metrics.observe("paragraph_seconds", seconds)
+    outcome = "skipped" if analyzed.skipped else "lexicon_only" if analyzed.degraded else "full"
+    metrics.count("paragraphs_total", outcome=outcome)
+    if analyzed.category:
+        metrics.count("paragraph_categories_total", category=analyzed.category)
+    if not analyzed.skipped:
+        for mark in analyzed.view.marks:
+            metrics.count("findings_total", rule=mark[4])
+
+
+def review_references(misses, annotations, positions, body_line, body_column, changes=None, metrics=None, selected=None):
+    """Adds the misses of CrossReferences to the annotations and returns their notes.
+    With `changes` (a ChangedLines) only the misses in changed lines are kept, and
+    with `selected` (an outline.OutlineEntry) only the ones in its lines."""
+    notes = ""
+    for index, match, key, rule in misses:
+        if selected and not selected.contains(index):
+            continue
+        line, column = positions[index]
+        start = source_position((line, column + match.start()), body_line, body_column)
+        if changes and not changes.touches(start[0], start[0]):
+            continue
+        notes += reference_note(key, rule)
+        if metrics:
+            metrics.count("findings_total", rule=rule)
+        if annotations:
+            annotations.add(rule, start, source_position((line, column + match.end()), body_line, body_column),
+                            match.group(0), messages[rule].format(f"'{key}'"))
+    return notes
+
+
+def insert_chapter_notes(new_tex, chapter_heads, notes):
+    """Inserts the note of each chapter (chapter ids start at 1) after its heading."""
+    parts = []
+    previous = 0
+    for chapter_id, head in enumerate(chapter_heads, start=1):
+        if chapter_id in notes:
+            parts.append(new_tex[previous:head])
+            parts.append(notes[chapter_id])
+            previous = head
+    parts.append(new_tex[previous:])
+    return "".join(parts)
+
+
+def join_paragraph(lines, i, positions, body_line, body_column):
+    """The paragraph that starts at lines[i], a LineType.PARAGRAPH: it goes on until a blank
+    line or one that starts with \\item or \\colchunk. Returns its text, joined with spaces,
+    its ParagraphPositions in the source file and the index of its last line."""
+    line = lines[i]
+    paragraph = ParagraphPositions()
+    paragraph.add_line(0, source_position(positions[i], body_line, body_column))
+    while i < len(lines) - 1:
+        next_line = lines[i + 1]
+        if len(next_line) > 0 and not next_line.startswith(r'\item') and not next_line.startswith(r'\colchunk'):
+            i += 1
+            line += " "
+            paragraph.add_line(len(line), source_position(positions[i], body_line, body_column))
+            line += next_line
+        else:
+            break
+    return line, paragraph, i
+
+
+def skip_block(lines, i):
+    """The environment or display math that starts at lines[i], which isn't reviewed,
+    and the index of its last line."""
+    line = lines[i]
+    block = ""
+    if "\\begin" in line:
+        block, i = get_begin_end_block(lines, i)
+    if line == "\\[":
+        block, i = get_math_block(lines, i)
+    return block, i
+
+
+def source_position(position, body_line, body_column):
+    """Turns a (line, column) of the body, as recorded by format_latex_commands,
+    into a 1-based (line, column) of the source file."""
+    line, column = position
+    if line == 0:
+        column += body_column - 1
+    return body_line + line, column + 1
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Finds errors in the writing of a LaTeX thesis.")
+    parser.add_argument("file_path", nargs="?", default="ejemplo1.tex", help="LaTeX file to review")
+    parser.add_argument("output_tex", nargs="?", default="Dario.tex", help="annotated LaTeX file to write")
+    parser.add_argument("--annotations", metavar="PATH", help="write every finding to PATH as JSON Lines")
+    parser.add_argument("--lint-only", action="store_true", help="only collect the findings, don't write the annotated file (needs --annotations)")
+    parser.add_argument("--mode", choices=nlp_modes, default="accurate", help="fast skips the dependency parser and NER (default: accurate)")
+    parser.add_argument("--memory-report", action="store_true", help="print the peak and retained memory of each stage and paragraph")
+    parser.add_argument("--max-memory", type=float, metavar="MB", help="memory budget; over it the review continues in a constrained mode")
+    parser.add_argument("--rules", nargs="+", choices=rule_names, metavar="RULE",
+                        help="only run these checkers: " + ", ".join(rule_names) + " (default: all)")
+    parser.add_argument("--compact", action="store_true",
+                        help="one margin note per sentence, light repetition marks and the overflow of notes at the end of each chapter")
+    parser.add_argument("--overuse", action="store_true", help="index the lemmas of the whole document and summarize the overused words of each chapter")
+    parser.add_argument("--parse-cache", type=float, nargs="?", metavar="MB", const=default_max_size / (1024 * 1024),
+                        help="keep the spaCy parses in an on-disk cache of this size, so reviewing the document "
+                             f"again only parses what changed (default size: {default_max_size // (1024 * 1024)})")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS", default=default_time_budget,
+                        help="time for the checkers of a paragraph, then only the lexicons are checked; 0 for no limit (default: %(default)g)")
+    parser.add_argument("--metrics", metavar="PATH", help="write the counters and timings of the review to PATH in the Prometheus text format")
+    parser.add_argument("--metrics-json", metavar="PATH", help="write a JSON summary of the counters and timings to PATH")
+    parser.add_argument("--dictionary", metavar="PATH", help="Spanish wordlist, one word per line, to check the spelling against (default: /usr/share/dict/spanish when installed)")
+    parser.add_argument("--glossary", metavar="PATH", help="words that are right even if the wordlist doesn't have them, one term per line")
+    parser.add_argument("--frequencies", metavar="PATH",
+                        help="Spanish frequency list, 'word count' per line, whose most frequent words aren't flagged as repeated (default: frecuencias_es.txt when there)")
+    parser.add_argument("--frequent-rank", type=int, default=default_max_rank, metavar="N",
+                        help="with a frequency list, the N most frequent words aren't flagged as repeated (default: %(default)d)")
+    parser.add_argument("--no-preflight", action="store_true", help="analyze every paragraph as prose, also tables, code and URLs")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--section", metavar="SECTION", help="only review this section: its number (3.2) or part of its title")
+    scope.add_argument("--chapter", metavar="CHAPTER", help="only review this chapter: its number or part of its title")
+    parser.add_argument("--outline", action="store_true", help="print the chapters and sections with the time spent checking each")
+    parser.add_argument("--since", metavar="REV",
+                        help="only review the paragraphs and headings changed since the git revision REV (can't be used with --overuse)")
+    parser.add_argument("--deterministic", action="store_true",
+                        help="guarantee byte-identical output for the same input (can't be used with --max-memory)")
+    args = parser.parse_args()
+    if args.lint_only and not args.annotations:
+        parser.error("--lint-only needs --annotations")
+    if args.deterministic and args.max_memory:
+        parser.error("--deterministic can't be used with --max-memory")
+    if args.since and args.overuse:
+        parser.error("--since can't be used with --overuse")
+    if (args.section or args.chapter) and args.overuse:
+        parser.error("--section and --chapter can't be used with --overuse")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    max_memory = int(args.max_memory * 1024 * 1024) if args.max_memory else None
+    parse_cache_size = int(args.parse_cache * 1024 * 1024) if args.parse_cache else 0
+    metrics = Metrics() if args.metrics or args.metrics_json else None
+    process_tex_file(args.file_path, args.output_tex, annotations_path=args.annotations, lint_only=args.lint_only, mode=args.mode,
+                     memory_report=args.memory_report, max_memory=max_memory, overuse=args.overuse, rules=args.rules,
+                     compact=args.compact, deterministic=args.deterministic, since=args.since, parse_cache_size=parse_cache_size,
+                     time_budget=args.time_budget, metrics=metrics, preflight=not args.no_preflight, section=args.section,
+                     chapter=args.chapter, print_outline=args.outline, dictionary=args.dictionary, glossary=args.glossary,
+                     frequencies=args.frequencies, frequent_rank=args.frequent_rank)
+    if metrics:
+        metrics.write(args.metrics, args.metrics_json)
 
 
 
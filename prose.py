@@ -0,0 +1,71 @@
+import re
+
+from utils import find_math_spans
+
+# line_classifier takes everything it doesn't know for a paragraph: table rows
+# written without tabular, code, lists of URLs, BibTeX entries, formulas. Each
+# of these kinds is told apart from prose by a few cheap measures of the
+# segments, and routed to the checkers that still make sense for it.
+url_pattern = re.compile(r"(?:https?|ftp)://\S+|www\.\S+")
+bibtex_pattern = re.compile(r"@[a-zA-Z]+\s*\{[^,\s{}]*,|(?:\b[a-zA-Z]+\s*=\s*[{\"].*?){3}", re.DOTALL)
+
+# at least this many & and \\ per word is a table
+min_table_density = 0.15
+# at least this share of the paragraph in URLs is a list of links
+min_url_share = 0.3
+# at least this share of the paragraph in math is a formula
+min_math_share = 0.6
+# less than this share of letters in the text, or longer words on average, is code
+min_alpha_ratio = 0.6
+max_word_length = 15
+# with fewer tokens one URL or two \\ are enough to pass the shares above, so
+# a sentence with a link or a line break can't be told from a list of links or
+# a table: it's "short_layout", checked with the lexicon checkers only
+min_layout_tokens = 20
+
+# kind of paragraph: "skip" (no checker) or "lexicon" (only the lexicon
+# checkers, see analysis.lexicon_rules); prose runs every checker
+prose_routes = {
+    "empty": "skip",
+    "bibtex": "skip",
+    "urls": "skip",
+    "table": "skip",
+    "code": "skip",
+    "math": "lexicon",
+    "short_layout": "lexicon",
+}
+
+
+def prose_features(view) -> dict:
+    """The measures of a SegmentView that prose_category looks at."""
+    paragraph, text = view.paragraph, view.text
+    tokens = text.split()
+    visible = len(text) - sum(map(str.isspace, text))
+    row_marks = paragraph.count("&") - paragraph.count("\\&") + paragraph.count("\\\\")
+    return {
+        "alpha_ratio": sum(map(str.isalpha, text)) / visible if visible else 0,
+        "table_density": row_marks / max(len(tokens), 1),
+        "row_marks": row_marks,
+        "tokens": len(tokens),
+        "math_share": sum(end - start for start, end in find_math_spans(paragraph)) / max(len(paragraph), 1),
+        "url_share": sum(len(url) for url in url_pattern.findall(paragraph)) / max(len(paragraph), 1),
+        "word_length": sum(map(len, tokens)) / len(tokens) if tokens else 0,
+    }
+
+
+def prose_category(view) -> str:
+    """The kind of paragraph of a SegmentView: "prose" or one of prose_routes."""
+    if not view.text.strip():
+        return "empty"
+    if bibtex_pattern.search(view.paragraph):
+        return "bibtex"
+    features = prose_features(view)
+    if features["url_share"] >= min_url_share:
+        return "urls" if features["tokens"] >= min_layout_tokens else "short_layout"
+    if features["row_marks"] >= 2 and features["table_density"] >= min_table_density:
+        return "table" if features["tokens"] >= min_layout_tokens else "short_layout"
+    if features["math_share"] >= min_math_share:
+        return "math"
+    if features["alpha_ratio"] < min_alpha_ratio or features["word_length"] > max_word_length:
+        return "code"
+    return "prose"
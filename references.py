@@ -0,0 +1,157 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+
+from utils import inline_comment_pattern
+
+# parsed .bib files, one JSON list of keys per file content hash
+bib_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "bib")
+
+cite_commands = r"[a-zA-Z]*cite[a-zA-Z]*"
+ref_commands = r"ref|eqref|autoref|cref|Cref|pageref|cpageref|nameref|vref"
+# every \cite-like command, \ref-like command, \label and \bibitem, with up to
+# two optional arguments before the keys
+reference_pattern = re.compile(r"""
+    \\(?P<command>""" + cite_commands + "|" + ref_commands + r"""|label|bibitem)\*?
+    (?:\s*\[[^\]]*\]){0,2}
+    \s*\{(?P<keys>[^{}]*)\}
+""", re.VERBOSE)
+bib_resource_pattern = re.compile(r"\\(?:addbibresource|bibliography)(?:\[[^\]]*\])?\{([^}]*)\}")
+input_pattern = re.compile(r"\\(?:input|include)\{([^}]*)\}")
+# @type{key, ... (the @string, @preamble and @comment blocks have no key)
+bib_entry_pattern = re.compile(r"@(?!(?:string|preamble|comment)\b)[a-zA-Z]+\s*[{(]\s*([^,\s{}()]+)\s*,", re.IGNORECASE)
+
+messages = {
+    "missing_citation": "La cita {} no está en la bibliografía.",
+    "undefined_reference": "La referencia {} no tiene una etiqueta (label) en el documento.",
+}
+
+
+def file_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def parse_bib_keys(bib_path: str):
+    """The entry keys of a .bib file, read from the cache when the file didn't change."""
+    with open(bib_path, "rb") as f:
+        content = f.read()
+    cache_path = os.path.join(bib_cache_dir, file_hash(content) + ".json")
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        pass
+    keys = bib_entry_pattern.findall(content.decode("utf-8", errors="replace"))
+    try:
+        os.makedirs(bib_cache_dir, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(sorted(set(keys)), f)
+    except OSError:
+        pass  # the cache is optional
+    return set(keys)
+
+
+def without_comment(line: str) -> str:
+    """The line up to its % comment, so a commented-out reference isn't taken as one."""
+    match = inline_comment_pattern.search(line)
+    return line if match is None else line[:match.start()]
+
+
+def without_comments(text: str) -> str:
+    return "\n".join(without_comment(line) for line in text.split("\n"))
+
+
+def find_bib_files(tex_content: str, base_dir: str):
+    paths = []
+    for match in bib_resource_pattern.finditer(without_comments(tex_content)):
+        for name in match.group(1).split(","):
+            name = name.strip()
+            if not name:
+                continue
+            if not name.endswith(".bib"):
+                name += ".bib"
+            paths.append(os.path.join(base_dir, name))
+    return paths
+
+
+def included_labels(body: str, base_dir: str):
+    """The \\label keys of the files brought in with \\input or \\include."""
+    labels = set()
+    for match in input_pattern.finditer(without_comments(body)):
+        name = match.group(1).strip()
+        for path in (os.path.join(base_dir, name), os.path.join(base_dir, name + ".tex")):
+            if os.path.isfile(path):
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    for reference in reference_pattern.finditer(without_comments(f.read())):
+                        if reference.group("command") == "label":
+                            labels.update(key.strip() for key in reference.group("keys").split(","))
+                break
+    return labels
+
+
+def print_warning(message: str):
+    print(f"Warning: {message}")
+
+
+class CrossReferences:
+    """
+    Every citation key and \\ref of the body checked against the keys of the
+    .bib files (and \\bibitem) and the set of \\label keys. The references are
+    collected in one pass over the lines; misses_before hands out the ones
+    that don't resolve as the review goes past their lines. A bibliography
+    that can't be read is reported with `warn` (printed by default).
+    """
+
+    def __init__(self, lines, tex_content: str, file_path: str, warn=None):
+        warn = warn or print_warning
+        base_dir = os.path.dirname(os.path.abspath(file_path))
+        self.bib_keys = set()
+        self.bib_files = []
+        for bib_path in find_bib_files(tex_content, base_dir):
+            try:
+                self.bib_keys |= parse_bib_keys(bib_path)
+                self.bib_files.append(bib_path)
+            except OSError:
+                warn(f"couldn't read the bibliography '{bib_path}'")
+        self.labels = included_labels("\n".join(lines), base_dir)
+        citations = []
+        refs = []
+        for index, line in enumerate(lines):
+            # the comments are still in the lines, the matches before them keep their columns
+            for match in reference_pattern.finditer(without_comment(line)):
+                command = match.group("command")
+                keys = [key.strip() for key in match.group("keys").split(",")]
+                if command == "label":
+                    self.labels.update(keys)
+                elif command == "bibitem":
+                    self.bib_keys.update(keys)
+                elif re.fullmatch(cite_commands, command):
+                    citations += [(index, match, key) for key in keys if key and key != "*"]
+                else:
+                    refs += [(index, match, key) for key in keys if key]
+        # without a bibliography there's nothing to check the citations against
+        self.check_citations = bool(self.bib_files) or bool(self.bib_keys)
+        self.misses = []  # (line index, match, key, rule)
+        if self.check_citations:
+            self.misses += [(index, match, key, "missing_citation")
+                            for index, match, key in citations if key not in self.bib_keys]
+        self.misses += [(index, match, key, "undefined_reference")
+                        for index, match, key in refs if key not in self.labels]
+        self.misses.sort(key=lambda miss: (miss[0], miss[1].start()))
+        self.miss_lines = [miss[0] for miss in self.misses]
+        self.next_miss = 0
+
+    def misses_before(self, line_index: int):
+        """The misses in the lines before line_index not returned yet."""
+        end = bisect.bisect_left(self.miss_lines, line_index, self.next_miss)
+        misses = self.misses[self.next_miss:end]
+        self.next_miss = end
+        return misses
+
+
+def reference_note(key: str, rule: str) -> str:
+    # \detokenize keeps the _ and other special characters of the key as text
+    key = "\\texttt{\\detokenize{" + key + "}}"
+    return "\\notaparaelautor{" + messages[rule].format(key) + "}\n"
@@ -1,12 +1,11 @@
+import bisect
 import re
 import sys
-import spacy
 from collections import defaultdict, Counter
 
 
-from utils import NoteType, add_note, mark_first_second_person, mark_passive_voice, mark_weasel_spanglish, merge_dicts_by_start_order, separate_latex_commands
-
-nlp = spacy.load("es_core_news_sm")
+from frequency import ignored_words
+from utils import NoteType, SegmentView, add_note, get_nlp, mark_first_second_person, mark_passive_voice, mark_weasel_spanglish
 
 def process_latex_paragraph(text, ignore_words):
     '''Receives a paragraph that might contain latex commands or mathematic elements, which it ignores'''
@@ -28,6 +27,7 @@ def process_latex_paragraph(text, ignore_words):
 
 
 
+    nlp = get_nlp()
     allowed_content_spans = []
     ignored_spans = []
     words_with_positions = []
@@ -187,10 +187,18 @@ def process_latex_paragraph(text, ignore_words):
         word_freq[word] += 1
 
     # Map original positions to cleaned text for sentence alignment
+    # (a running count of the ignored spans open at each position, instead of testing every span)
+    span_changes = [0] * (len(text) + 1)
+    for s, e in all_ignored:
+        if s < e:
+            span_changes[s] += 1
+            span_changes[min(e, len(text))] -= 1
     original_to_cleaned = []
     cleaned_pos = 0
+    open_spans = 0
     for i in range(len(text)):
-        in_ignored = any(s <= i < e for s, e in all_ignored)
+        open_spans += span_changes[i]
+        in_ignored = open_spans > 0
         original_to_cleaned.append(cleaned_pos if not in_ignored else None)
         if not in_ignored:
             cleaned_pos += 1
@@ -211,15 +219,15 @@ def process_latex_paragraph(text, ignore_words):
         print(sentence)
 
     # Track word counts per sentence
+    sentence_starts = [sent_start for sent_start, _ in sentence_spans]
     word_sentence_counts = defaultdict(lambda: defaultdict(int))
     for start, _, word in words_with_positions:
         cleaned_start = original_to_cleaned[start]
         if cleaned_start is None:
             continue
-        for sent_idx, (sent_start, sent_end) in enumerate(sentence_spans):
-            if sent_start <= cleaned_start < sent_end:
-                word_sentence_counts[word][sent_idx] += 1
-                break
+        sent_idx = bisect.bisect_right(sentence_starts, cleaned_start) - 1
+        if sent_idx >= 0 and cleaned_start < sentence_spans[sent_idx][1]:
+            word_sentence_counts[word][sent_idx] += 1
 
     # Determine words to highlight
     words_to_highlight = set()
@@ -266,81 +274,115 @@ def process_latex_paragraph(text, ignore_words):
     return ''.join(modified_text)
 
 
-def check_starting_commands(text, word, to_analyze, to_ignore):
-    stripped_text = text.lstrip()
-    leading_spaces = len(text) - len(stripped_text)
-    
-    end_pos = 0
-    modification_needed = stripped_text.startswith(word)
-    
-    if modification_needed:
-        # Calculate end position (start of word + length of word)
-        first_key = next(iter(to_ignore))
-        first_value = to_ignore.pop(first_key)  # Remove old key
-
-        new_key = (0, first_key[1])  # Keep the original end
-
-        # Reinsert with the new key        
-        first_key = next(iter(to_analyze))
-        to_ignore[new_key] = to_analyze[first_key] + first_value
-        first_value = to_analyze.pop(first_key)  # Remove old key
-
-    # no need to sort dicts because the order affected is in to_ignore, which we sort when merging with to_analyze
-    return modification_needed
-
-def invalid_item_end(text, tmp_separator):
+def invalid_item_end(text):
     pattern = r'[.!?:;,]$|,\s*( y| o)$'
-    text = text.strip(tmp_separator)
     return not bool(re.search(pattern, text.strip()))
         # text = add_note(NoteType.ITEM_PUNCTUATION, text)
 
 
 
-def process_latex_paragraph1(text, ignore_words):
-    to_ignore, to_analyze = separate_latex_commands(text)
-    paragraph = ""
-    is_item = check_starting_commands(text, "\item", to_analyze, to_ignore)
-    
-    temp_separator = " my12345separator "  # Unique string with non-word characters
-
-    ignore_words.append(temp_separator.strip())
-    for value in to_analyze.values():
-        paragraph += value + temp_separator
+def process_latex_paragraph1(view: SegmentView, ignore_words, render = True):
+    '''Highlights repetitions and long sentences over the analyzable text of `view` and renders the paragraph with every mark.
+    With render=False only the marks are added (lint-only mode) and nothing is returned.'''
     colors = ['Green', 'Cerulean', 'red']
-    add_sign = False
-    if is_item and invalid_item_end(paragraph, temp_separator):
-        add_sign = True
-    paragraph = highlight_repeated_words_window(paragraph, colors, 200, ignore_words)
-    # Split into parts using separator
-    highlighted_parts = paragraph.split(temp_separator.strip()) # hace falta por si algún comando le quitó el espacio al separator
-    # regex_pattern = '\s*'+ temp_separator.strip() + '\s*'
-    # # regex_pattern = r'(\s*myseparator\s*)'  # Preserves surrounding spaces
-
-    # highlighted_parts = re.split(regex_pattern, paragraph) # hace falta por si algún comando le quitó el espacio al separator
-
-    # # Remove separator tokens but keep spaces
-    # highlighted_parts = [part for part in highlighted_parts if part != temp_separator]
-
-    # Update dictionary with highlighted parts
-    for key, part in zip(to_analyze.keys(), highlighted_parts):
-        to_analyze[key] = part 
-    p = merge_dicts_by_start_order(to_ignore, to_analyze)
-    if add_sign:
+    highlight_repeated_words_window(view, colors, 200, ignore_words)
+    if not render:
+        return None
+    return render_paragraph(view)
+
+
+def render_paragraph(view: SegmentView):
+    '''The paragraph of `view` with every mark, asking for a final sign when it's an item without one'''
+    p = view.render()
+    if view.paragraph.lstrip().startswith(r"\item") and invalid_item_end(view.text):
         p += r"  \agregaesto{SIGNO}"
     return p
 
 
-def highlight_repeated_words_window(text, color_list, window_size = 150, ignore_words = None, long_sentence_limit = 40, ):
-    if ignore_words is None:
-        ignore_words = []
-    # Normalize ignore_words to lower-case for case-insensitive comparison
-    ignore_words_set = set(w.lower() for w in ignore_words)
+# Words for the repetition count (whole non-space runs, except plain numbers),
+# words for highlighting and for the length of a sentence, and sentences
+# (ended by ., ! or ?, with the closing quote and the spaces after them)
+word_token_pattern = re.compile(r'\b(?!\d+$)[^\s]+\b')
+word_pattern = re.compile(r'\b\w+\b')
+sentence_pattern = re.compile(r'([^.!?]*[.!?]["\']?[ \t]*)')
+
+
+def word_tokens(text):
+    '''(word, start, end) of every word counted for repetitions'''
+    return [(m.group(0), m.start(), m.end()) for m in word_token_pattern.finditer(text)]
+
+
+def word_matches(text):
+    '''(lower-case word, start, end) of every \\w+ word'''
+    return [(m.group(0).lower(), m.start(), m.end()) for m in word_pattern.finditer(text)]
+
+
+def split_sentences(text):
+    '''(start, end) of every sentence; what follows the last ending is one more sentence'''
+    # every sentence starts where the previous one ends, so they cover a prefix
+    # of the text. Matching at that point only (finditer would retry every
+    # position of a last piece without an ending, and each try reads it to
+    # the end) keeps the split linear.
+    spans = []
+    extracted = 0
+    while True:
+        match = sentence_pattern.match(text, extracted)
+        if match is None:
+            break
+        spans.append(match.span())
+        extracted = match.end()
+    if extracted < len(text):
+        spans.append((extracted, len(text)))
+    return spans
+
+
+def highlight_repeated_words_window(view, color_list, window_size = 150, ignore_words = None, long_sentence_limit = 40, ):
+    '''Adds to `view` a mark for every repeated word and long sentence found in its logical text'''
+    words = word_matches(view.text)
+    highlight_long_sentences(view, ignore_words, long_sentence_limit, words=words)
+    highlight_repeated_words(view, color_list, window_size, ignore_words, words=words)
+
+
+def highlight_long_sentences(view, ignore_words = None, long_sentence_limit = 40, sentences = None, words = None):
+    '''Adds to `view` a mark for every sentence with more than long_sentence_limit words.
+    `sentences` and `words` are the split_sentences and word_matches of view.text when already computed.'''
+    text = view.text
+    ignore_words_set = ignored_words(ignore_words)
+    if sentences is None:
+        sentences = split_sentences(text)
+    if words is None:
+        words = word_matches(text)
+    word_starts = [start for _, start, _ in words]
+
+    for sentence_start, sentence_end in sentences:
+        # Count valid words in this sentence (a word never crosses the end of a sentence)
+        first = bisect.bisect_left(word_starts, sentence_start)
+        last = bisect.bisect_left(word_starts, sentence_end, first)
+        sentence_words = [w for w, _, _ in words[first:last] if len(w) > 2 and w.strip() not in ignore_words_set]
+        if len(sentence_words) > long_sentence_limit:
+            # Wrap the entire sentence with a custom highlight (e.g., tcolorbox or custom macro)
+            view.add_mark(sentence_start, sentence_end, r"\oracionlarga{", "} ", "long_sentence", "Oración larga")
+
+
+# before and after a repeated word: the full mark and the light one of the compact output
+repetition_marks = {
+    False: ("\\textcolor{{{color}}}{{[", "$^{{{index}}}$]}}"),
+    True: ("\\repetida{{{color}}}{{{index}}}{{", "}}"),
+}
+
+
+def highlight_repeated_words(view, color_list, window_size = 150, ignore_words = None, tokens = None, words = None, compact = False):
+    '''Adds to `view` a mark for every word repeated inside a window of window_size characters or at least 3 times.
+    The words in `ignore_words` (a list, or a frequency.FrequentWords) are never marked.
+    `tokens` and `words` are the word_tokens and word_matches of view.text when already computed.
+    With `compact` the words get the light \\repetida mark.'''
+    text = view.text
+    # Normalize ignore_words to lower-case for case-insensitive comparison; a
+    # frequency.FrequentWords looks the rank of each word up instead
+    ignore_words_set = ignored_words(ignore_words)
 
     # Tokenize words and keep track of their positions (start, end in chars)
-    words_with_pos = [
-        (m.group(0), m.start(), m.end())
-        for m in re.finditer(r'\b(?!\d+$)[^\s]+\b', text)  # Match sequences, exclude numbers-only
-    ]
+    words_with_pos = word_tokens(text) if tokens is None else tokens
     words_lower = [w[0].lower() for w in words_with_pos]
 
     # Define a filter function for valid words
@@ -351,82 +393,41 @@ def highlight_repeated_words_window(text, color_list, window_size = 150, ignore_
     filtered_words = [w for w in words_lower if is_valid(w)]
     word_global_count = Counter(filtered_words)
 
-    # Find words repeated at least twice within any sliding window of size window_size (in chars)
+    # Find words repeated at least twice within any sliding window of size window_size (in chars).
+    # A window starting at `start` (0 <= start <= len(text) - window_size) touches a word
+    # if word_start < start + window_size and word_end > start, so two occurrences share
+    # a window when some start lies in [later_start - window_size + 1, earlier_end - 1].
+    # The closest pair is always two consecutive occurrences, so one pass over the words is enough.
     repeated_in_window = set()
-    text_length = len(text)
-    step = 1  # You can increase this for speed if needed
-
-    for start in range(0, text_length - window_size + 1, step):
-        end = start + window_size
-        # Find words that are fully or partially within the window and valid
-        window_words = [
-            w[0].lower()
-            for w in words_with_pos
-            if (w[1] < end and w[2] > start) and is_valid(w[0].lower())
-        ]
-        window_count = Counter(window_words)
-        for word, count in window_count.items():
-            if count >= 2:
+    last_window_start = len(text) - window_size
+    previous_end = {}
+    for word, (_, word_start, word_end) in zip(words_lower, words_with_pos):
+        if not is_valid(word):
+            continue
+        if word in previous_end:
+            first_window = max(word_start - window_size + 1, 0)
+            if first_window <= min(previous_end[word] - 1, last_window_start):
                 repeated_in_window.add(word)
+        previous_end[word] = word_end
 
-    # Combine with words appearing at least 3 times globally
-    target_words = {w for w in word_global_count if word_global_count[w] >= 3 or w in repeated_in_window}
+    # Combine with words appearing at least 3 times globally, in the order of their
+    # first occurrence (the Counter keeps it) so the colors and indices don't
+    # depend on the hash seed
+    target_words = [w for w in word_global_count if word_global_count[w] >= 3 or w in repeated_in_window]
     # Assign colors cycling through the list
-    color_map = {}
-    word_index_map = {}
-    for idx, word in enumerate((target_words)):
-        color_map[word] = color_list[idx % len(color_list)]
-        idx+=1
-        word_index_map[word] = idx
-
-
+    color_map = {word: color_list[idx % len(color_list)] for idx, word in enumerate(target_words)}
     # Assign a unique index to each word in target_words (starting at 1)
-    word_index_map = {word: idx + 1 for idx, word in enumerate((target_words))}
-
-    
-    
-    # Function to replace words with highlighted version
-    def replacer(match):
-        word = match.group(0)
-        word_lower = word.lower()
+    word_index_map = {word: idx + 1 for idx, word in enumerate(target_words)}
+
+    # Now apply repeated-word highlighting
+    if words is None:
+        words = word_matches(text)
+    before, after = repetition_marks[compact]
+    for word_lower, start, end in words:
         if word_lower in color_map:
             color = color_map[word_lower]
             index = word_index_map[word_lower]
-            return f"\\textcolor{{{color}}}{{[{word}$^{{{index}}}$]}}"
-        else:
-            return word
-    
-    # --- Long sentence detection and highlighting ---
-    # Split text into sentences (handles ., !, ? followed by space or end of string)
-    sentence_pattern = r'([^.!?]*[.!?]["\']?[ \t]*)'
-
-    sentences = re.findall(sentence_pattern, text)
-    # if not sentences:
-    #     sentences = [text]
-    
-    # if the last found sentence doesn't end the text then add what remains as another sentence.
-    # Check if the last sentence ends the text
-    extracted_text = ''.join(sentences)
-    if len(extracted_text) < len(text):
-        sentences.append(text[len(extracted_text):])
-    highlighted_sentences = []
-
-    for sentence in sentences:
-        # Count valid words in this sentence
-        sentence_words = [w.lower() for w in re.findall(r'\b\w+\b', sentence) if is_valid(w.lower())]
-        print(sentence_words)
-        if len(sentence_words) > long_sentence_limit:
-            # Wrap the entire sentence with a custom highlight (e.g., tcolorbox or custom macro)
-            command = "{\color{Thistle} ["
-            sentence = r"\oracionlarga{"+ f"{sentence}" + "} "
-        highlighted_sentences.append(sentence)
-
-    # Reconstruct the text with long sentences marked
-    marked_text = ''.join(highlighted_sentences)
-
-    # Now apply repeated-word highlighting
-    highlighted_text = re.sub(r'\b\w+\b', replacer, marked_text)
-    return highlighted_text
+            view.add_mark(start, end, before.format(color=color, index=index), after.format(color=color, index=index), "repetition", f"Palabra repetida: {word_lower}")
 
 
 
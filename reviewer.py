@@ -0,0 +1,147 @@
+import logging
+import threading
+
+from analysis import Analyzer, degraded_note
+from annotations import Annotations, ParagraphPositions
+from frequency import FrequencyTable, FrequentWords, default_max_rank, load_frequencies
+from parse_cache import ParseCache
+from pre_processing import default_time_budget, ignore_for_repetition, join_paragraph, process_tex_file, skip_block, spanglish, weasels
+from repetition import render_paragraph
+from spelling import SpellingDictionary, load_dictionary
+from utils import LineType, compile_rules, line_classifier, load_pipeline, parse_chunks, passive_voice_rules, person_rules, preprocess_lines
+
+# the lines that aren't prose nor start an environment: written as they are
+unreviewed_lines = (LineType.SECTION, LineType.CHAPTER, LineType.COMMAND, LineType.IMAGE, LineType.COMMENT, LineType.BEGIN_BLOCK_START_END)
+# where the warnings and the files written of review_file go, instead of the output
+logger = logging.getLogger("reviewer")
+
+
+class ReviewedParagraph:
+    """The review of one paragraph: the LaTeX with its marks, the findings as the
+    records of annotations.Annotations, and, as in analysis.Paragraph, why the
+    checkers didn't all run (`degraded`) and the kind of paragraph (`category`)."""
+
+    def __init__(self, latex: str, findings, degraded=None, category=None):
+        self.latex = latex
+        self.findings = findings
+        self.degraded = degraded
+        self.category = category
+
+
+class Reviewer:
+    """
+    The review as a library: owns its spaCy pipeline (loaded for `mode`, or the
+    given `pipeline`), its lexicons and its configuration (see
+    pre_processing.process_tex_file for each option), and keeps nothing of a
+    review after it returns. The module globals of utils (the pipeline in use,
+    the parse cache, the metrics, the compiled rules of rule_matcher) are never
+    read or written: the passive voice and person rules are compiled for its own
+    pipeline and kept in `matchers`, so utils.drop_nlp_caches can't take them away
+    in the middle of a review. One instance can be shared by many threads: each
+    review builds its own Analyzer and only the calls into spaCy, which isn't safe
+    to run concurrently, are serialized. The time budget only interrupts a checker
+    in the main thread; in the others it's checked between checkers. Nothing is
+    printed: the warnings go to `logger` (the "reviewer" logger by default).
+    """
+
+    def __init__(self, mode="accurate", rules=None, weasels=weasels, spanglish=spanglish, ignore_words=ignore_for_repetition,
+                 compact=False, time_budget=default_time_budget, preflight=True, parse_cache_size=0, pipeline=None, dictionary=None,
+                 glossary=(), frequencies=None, frequent_rank=default_max_rank, logger=logger):
+        self.pipeline = pipeline if pipeline is not None else load_pipeline(mode)
+        # copies, so changing the lists given (or the ones of pre_processing) doesn't change a review in progress
+        self.weasels = tuple(weasels)
+        self.spanglish = tuple(spanglish)
+        # with a frequency list (a path or a FrequencyTable) its most frequent words replace `ignore_words`
+        frequency_table = frequencies if isinstance(frequencies, FrequencyTable) else load_frequencies(frequencies)
+        if frequency_table:
+            self.ignore_words = FrequentWords(frequency_table, frequent_rank)
+        else:
+            self.ignore_words = frozenset(word.lower() for word in ignore_words)
+        self.rules = None if rules is None else tuple(rules)
+        self.compact = compact
+        self.time_budget = time_budget
+        self.preflight = preflight
+        self.parse_cache = ParseCache(max_size=parse_cache_size) if parse_cache_size else None
+        # a wordlist path or an already built SpellingDictionary, which is read-only and can be shared
+        self.dictionary = dictionary if isinstance(dictionary, SpellingDictionary) else load_dictionary(dictionary)
+        self.glossary = frozenset(word.lower() for word in glossary)
+        self.lock = threading.Lock()
+        self.logger = logger
+        # compiled now, so no thread compiles them while another matches
+        self.matchers = {id(rules): compile_rules(self.pipeline.vocab, rules) for rules in (passive_voice_rules, person_rules)}
+        # an unknown rule fails here and not in the first review
+        self.analyzer()
+
+    def parse(self, text: str):
+        with self.lock:
+            return self.pipeline(text) if self.parse_cache is None else self.parse_cache.parse(self.pipeline, text)
+
+    def parse_chunks(self, text: str):
+        return parse_chunks(text, self.pipeline, self.parse)
+
+    def analyzer(self, fix_citations=True) -> Analyzer:
+        return Analyzer(self.rules, self.weasels, self.spanglish, self.ignore_words, fix_citations=fix_citations, compact=self.compact,
+                        time_budget=self.time_budget, preflight=self.preflight, parser=self.parse_chunks,
+                        dictionary=self.dictionary, glossary=self.glossary, matchers=self.matchers)
+
+    def review_paragraph(self, analyzer: Analyzer, text: str, positions: ParagraphPositions, name: str = "<text>") -> ReviewedParagraph:
+        annotations = Annotations(name)
+        if "cite_usage" in analyzer.rules:
+            annotations.add_citations(text, positions)
+        analyzed, _ = analyzer.analyze(text)
+        if analyzed.degraded:
+            annotations.add("degraded", positions.locate(0), positions.locate(len(text)), text, analyzed.degraded)
+        if analyzed.skipped:
+            latex = text
+        else:
+            annotations.add_paragraph(analyzed.view, positions, analyzed.edits)
+            latex = render_paragraph(analyzed.view)
+        if analyzed.degraded:
+            latex = degraded_note(analyzed) + latex
+        return ReviewedParagraph(latex, annotations.records, analyzed.degraded, analyzed.category)
+
+    def review_paragraphs(self, paragraphs, name: str = "<text>"):
+        """Reviews each of `paragraphs` (LaTeX text, without headings or environments); the lines of each count from 1."""
+        analyzer = self.analyzer()
+        reviewed = []
+        for text in paragraphs:
+            # the lines are joined the way pre_processing joins them, the offsets don't move
+            positions = ParagraphPositions()
+            offset = 0
+            for number, line in enumerate(text.split("\n")):
+                positions.add_line(offset, (1 + number, 1))
+                offset += len(line) + 1
+            reviewed.append(self.review_paragraph(analyzer, text.replace("\n", " "), positions, name))
+        return reviewed
+
+    def review_text(self, text: str, name: str = "<text>"):
+        """Reviews the paragraphs of `text`, a piece of a document body, the way
+        process_tex_file finds them: without the comments, the headings, the
+        environments and the display math. The findings have their line and
+        column in `text`."""
+        analyzer = self.analyzer()
+        positions = []
+        lines = list(preprocess_lines(text, positions))
+        reviewed = []
+        i = 0
+        while i < len(lines):
+            if lines[i].strip():
+                line_type = line_classifier(lines[i])
+                if line_type is LineType.PARAGRAPH:
+                    paragraph, paragraph_positions, i = join_paragraph(lines, i, positions, 1, 1)
+                    reviewed.append(self.review_paragraph(analyzer, paragraph, paragraph_positions, name))
+                elif line_type not in unreviewed_lines:
+                    _, i = skip_block(lines, i)
+            i += 1
+        return reviewed
+
+    def review_file(self, file_path: str, output_tex: str = None, annotations_path: str = None, overuse=False, deterministic=False,
+                    since=None, section=None, chapter=None, metrics=None):
+        """Reviews a whole LaTeX document like pre_processing.process_tex_file and returns
+        its findings (the records of the annotations). Without `output_tex` nothing
+        is rendered; the names of the files written are logged at the INFO level."""
+        annotations = process_tex_file(file_path, output_tex, annotations_path, lint_only=output_tex is None, rules=self.rules,
+                                       compact=self.compact, overuse=overuse, deterministic=deterministic, since=since,
+                                       time_budget=self.time_budget, metrics=metrics, preflight=self.preflight,
+                                       section=section, chapter=chapter, reviewer=self)
+        return annotations.records
@@ -0,0 +1,162 @@
+import argparse
+import functools
+import gc
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from ai_phrasing import mark_ai_phrasing
+from repetition import highlight_repeated_words_window
+from spelling import SpellingDictionary, mark_spelling
+from utils import SegmentView, fix_cite_usage, line_classifier, mark_first_second_person, mark_passive_voice, mark_weasel_spanglish, preprocess_lines
+
+words = [
+    "datos", "modelo", "resultado", "sistema", "algoritmo", "trabajo", "tesis", "valor",
+    "el", "la", "de", "que", "en", "los", "se", "con", "para", "una", "por", "muy",
+    "fue", "realizado", "es", "usado", "proponemos", "análisis", "método", "muchos",
+]
+fragments = [r"\textbf{resultado}", r"\textit{método}", "$x_i + y$", r"\cite{autor2020}", r"~\ref{fig:uno}", "\\%"]
+
+# growth exponent allowed for each stage (1.0 is linear), checked on the median of
+# the seeds: the exponent of a single seed moves by a few tenths between runs
+default_bound = 1.3
+bounds = {}
+# inputs generated for each stage, the median of their exponents is checked
+default_seeds = 3
+
+
+def make_sentence(rng):
+    sentence = [rng.choice(words) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.5:
+        sentence.insert(rng.randrange(len(sentence)), rng.choice(fragments))
+    return " ".join(sentence).capitalize() + "."
+
+
+def make_paragraph(sentences, rng):
+    return " ".join(make_sentence(rng) for _ in range(sentences))
+
+
+def make_document(paragraphs, rng):
+    parts = []
+    for index in range(paragraphs):
+        if index % 20 == 0:
+            parts.append(r"\section{Sección %d}" % index)
+        parts.append(make_paragraph(4, rng) + " % nota\n" + make_paragraph(2, rng))
+        if index % 7 == 0:
+            parts.append("\\begin{itemize}\n\\item " + make_sentence(rng) + "\n\\end{itemize}")
+    return "\n\n".join(parts)
+
+
+def marked_view(paragraph):
+    view = SegmentView(paragraph)
+    mark_weasel_spanglish(["muy", "muchos"], ["parsear"], view, 0)
+    highlight_repeated_words_window(view, ['Green', 'Cerulean', 'red'], 200, ["el", "la", "de", "que"])
+    return view
+
+
+@functools.lru_cache(maxsize=None)
+def word_dictionary():
+    """A SpellingDictionary of the generated words but the last four, so some are marked."""
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "palabras.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(words[:-4]))
+    return SpellingDictionary(path, folder)
+
+
+# name: (kind of input, prepare the input, run the stage, needs spaCy)
+stages = {
+    "preprocess": ("document", lambda text: text, lambda text: list(preprocess_lines(text)), False),
+    "classify": ("document", lambda text: list(preprocess_lines(text)), lambda lines: [line_classifier(line) for line in lines], False),
+    "cite_usage": ("paragraph", lambda text: text, fix_cite_usage, False),
+    "segment_view": ("paragraph", lambda text: text, SegmentView, False),
+    "weasel_spanglish": ("paragraph", SegmentView, lambda view: mark_weasel_spanglish(["muy", "muchos", "en gran medida"], ["parsear"], view, 0), False),
+    "repetition": ("paragraph", SegmentView, lambda view: highlight_repeated_words_window(view, ['Green', 'Cerulean', 'red'], 200, ["el", "la", "de", "que"]), False),
+    "spelling": ("paragraph", SegmentView, lambda view: mark_spelling(word_dictionary(), view, 0), False),
+    "ai_phrasing": ("paragraph", SegmentView, lambda view: mark_ai_phrasing(view, 0), False),
+    "render": ("paragraph", marked_view, lambda view: view.render(), False),
+    "passive_voice": ("paragraph", SegmentView, lambda view: mark_passive_voice(view, 0), True),
+    "person": ("paragraph", SegmentView, lambda view: mark_first_second_person(view, 0), True),
+}
+
+
+def time_stage(name, size, repeat, seed):
+    """Best time of `repeat` runs of the stage on a generated input of `size` units."""
+    kind, prepare, run, _ = stages[name]
+    rng = random.Random(seed)
+    text = make_document(size, rng) if kind == "document" else make_paragraph(size, rng)
+    return time_run(prepare, run, text, repeat)
+
+
+def time_run(prepare, run, text, repeat):
+    """Best time of `repeat` runs of `run` on prepare(text)."""
+    best = math.inf
+    # one collection for all the runs: it takes longer than most of them
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            # inputs that the stage modifies (the marks of a view) are rebuilt on every run
+            stage_input = prepare(text)
+            start = time.perf_counter()
+            run(stage_input)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def growth_exponent(sizes, times):
+    """Slope of the least-squares line of log(time) against log(size)."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+
+def seed_growth(sizes, time_case, seeds):
+    """The median time of each size and the median growth exponent of time_case(size, seed)
+    over `seeds`, and the exponent of each seed: one noisy timing moves the exponent of
+    its seed, not the median."""
+    runs = [[time_case(size, seed) for size in sizes] for seed in seeds]
+    exponents = [growth_exponent(sizes, times) for times in runs]
+    return [statistics.median(times) for times in zip(*runs)], statistics.median(exponents), exponents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that every stage of the review scales near-linearly (python scaling.py).")
+    parser.add_argument("--stages", nargs="+", choices=list(stages), help="stages to check (default: all that don't need spaCy)")
+    parser.add_argument("--nlp", action="store_true", help="also check the stages that run the spaCy model")
+    parser.add_argument("--size", type=int, default=100, help="N: paragraphs of the document or sentences of the paragraph (default: 100)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per size, the best one is kept (default: 5)")
+    parser.add_argument("--bound", type=float, help=f"growth exponent allowed for every stage (default: {default_bound})")
+    parser.add_argument("--seed", type=int, default=0, help="first seed of the generated inputs (default: 0)")
+    parser.add_argument("--seeds", type=int, default=default_seeds, help=f"seeds tried, the median exponent is checked (default: {default_seeds})")
+    args = parser.parse_args()
+
+    names = args.stages or [name for name, stage in stages.items() if args.nlp or not stage[3]]
+    sizes = [args.size * factor for factor in (1, 2, 4, 8)]
+    seeds = range(args.seed, args.seed + args.seeds)
+    failed = []
+    print(f"{'stage':<18} " + " ".join(f"{'N=' + str(size):>10}" for size in sizes) + f" {'exponent':>9} {'seeds':>11} {'bound':>6}")
+    for name in names:
+        times, exponent, exponents = seed_growth(sizes, lambda size, seed: time_stage(name, size, args.repeat, seed), seeds)
+        bound = args.bound or bounds.get(name, default_bound)
+        status = "" if exponent <= bound else "  FAILED"
+        if status:
+            failed.append(name)
+        print(f"{name:<18} " + " ".join(f"{t * 1000:>8.2f}ms" for t in times)
+              + f" {exponent:>9.2f} {min(exponents):>5.2f}-{max(exponents):<5.2f} {bound:>6.2f}{status}")
+
+    if failed:
+        print("Superlinear stages:", ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
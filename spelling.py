@@ -0,0 +1,172 @@
+import array
+import functools
+import hashlib
+import mmap
+import os
+import re
+import sys
+import unicodedata
+
+from prose import url_pattern
+
+# the compiled wordlists, one index per wordlist and version of it
+dictionary_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "dictionaries")
+# the wordlist of the Debian/Ubuntu package wspanish; any UTF-8 list with one word per line works
+default_dictionary = "/usr/share/dict/spanish"
+# 12 bytes of format version, then the number of words in 4 so the offsets start aligned
+index_magic = b"DICCIONARIO1"
+letters = "abcdefghijklmnñopqrstuvwxyzáéíóúü"
+accents = {"a": "á", "e": "é", "i": "í", "o": "ó", "u": "úü", "n": "ñ"}
+# the suggestions are looked up among the words at one edit, so their cost is bounded by the length
+max_suggestion_length = 25
+max_suggestions = 3
+# \newacronym{key}{short}{long} and the name of \newglossaryentry{key}{name=...}
+glossary_pattern = re.compile(r"\\newacronym\s*(?:\[[^\]]*\])?\{[^}]*\}\{([^}]*)\}\{([^}]*)\}|\\newglossaryentry\s*\{[^}]*\}\s*\{[^{}]*?name\s*=\s*\{?([^,}]*)")
+glossary_word_pattern = re.compile(r"\w+")
+
+
+def normalize(word: str) -> str:
+    return unicodedata.normalize("NFC", word).lower()
+
+
+def compile_index(lines) -> bytes:
+    """The index of a wordlist: the header, the offsets of the words (uint32, all in the byte order of the machine) and
+    the sorted UTF-8 words one after the other. Whatever follows a / (hunspell flags) is dropped."""
+    words = sorted({normalize(line.split("/")[0].strip()).encode("utf-8") for line in lines} - {b""})
+    offsets = array.array("I", [0])
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+    return index_magic + len(words).to_bytes(4, sys.byteorder) + offsets.tobytes() + b"".join(words)
+
+
+def compiled_index(path: str, folder: str, compile_lines):
+    """The memory map of compile_lines(the lines of `path`), built the first time and
+    kept in `folder` under a key of the path, size and modification time of the file."""
+    stat = os.stat(path)
+    key = hashlib.sha256(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    index_path = os.path.join(folder, key + ".idx")
+    if not os.path.exists(index_path):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            data = compile_lines(f)
+        os.makedirs(folder, exist_ok=True)
+        # written to a temporary file and renamed, so a review never maps half an index
+        temporary = f"{index_path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, index_path)
+    with open(index_path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class SpellingDictionary:
+    """
+    A Spanish wordlist compiled once into a sorted index on disk (see
+    compile_index), memory-mapped and searched by bisection: the words are
+    never loaded into Python objects, and processes that map the same index
+    share its pages. The index is rebuilt when the wordlist changes.
+    """
+
+    def __init__(self, path: str, folder: str = dictionary_cache_dir):
+        self.path = path
+        self.map = compiled_index(path, folder, compile_index)
+        self.size = int.from_bytes(self.map[len(index_magic):len(index_magic) + 4], sys.byteorder)
+        start = len(index_magic) + 4
+        self.offsets = memoryview(self.map)[start:start + 4 * (self.size + 1)].cast("I")
+        self.words_start = start + 4 * (self.size + 1)
+        # the same words come back in every paragraph; lru_cache is safe to share between threads
+        self.contains = functools.lru_cache(maxsize=1 << 16)(self.lookup)
+        self.suggestions = functools.lru_cache(maxsize=1 << 12)(self.find_suggestions)
+
+    def __len__(self):
+        return self.size
+
+    def word(self, index: int) -> bytes:
+        return self.map[self.words_start + self.offsets[index]:self.words_start + self.offsets[index + 1]]
+
+    def lookup(self, word: str) -> bool:
+        target = normalize(word).encode("utf-8")
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.word(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.size and self.word(low) == target
+
+    def find_suggestions(self, word: str):
+        """Up to max_suggestions words at one edit of `word`, the missing accents first."""
+        word = normalize(word)
+        if len(word) > max_suggestion_length:
+            return ()
+        splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+        candidates = [left + accented + right[1:] for left, right in splits if right for accented in accents.get(right[0], "")]
+        candidates += [left + right[1:] for left, right in splits if right]
+        candidates += [left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1]
+        candidates += [left + letter + right[1:] for left, right in splits if right for letter in letters]
+        candidates += [left + letter + right for left, right in splits for letter in letters]
+        found = []
+        for candidate in dict.fromkeys(candidates):
+            if candidate != word and self.contains(candidate):
+                found.append(candidate)
+                if len(found) == max_suggestions:
+                    break
+        return tuple(found)
+
+
+def load_dictionary(path: str = None):
+    """The SpellingDictionary of `path`, or of default_dictionary when it's installed (None when it isn't)."""
+    if path is None:
+        if not os.path.exists(default_dictionary):
+            return None
+        path = default_dictionary
+    return SpellingDictionary(path)
+
+
+def read_glossary(path: str):
+    """The words of a glossary file with one term per line."""
+    with open(path, encoding="utf-8") as f:
+        return {normalize(word) for word in glossary_word_pattern.findall(f.read())}
+
+
+def document_glossary(tex: str):
+    """The words of the acronyms and glossary entries the document defines."""
+    words = set()
+    for match in glossary_pattern.finditer(tex):
+        for group in match.groups():
+            words.update(normalize(word) for word in glossary_word_pattern.findall(group or ""))
+    return words
+
+
+def sentence_start(text: str, start: int) -> bool:
+    """Whether only opening punctuation and spaces separate `start` from the end of the previous sentence."""
+    position = start - 1
+    while position >= 0 and (text[position].isspace() or text[position] in "¿¡(«\"'"):
+        position -= 1
+    return position < 0 or text[position] in ".!?:"
+
+
+def mark_spelling(dictionary: SpellingDictionary, view, comments, words=None, known=frozenset()) -> int:
+    """Wraps the words of the analyzable text that aren't in `dictionary` nor in `known` (the glossary
+    and the lexicons, lower-case) in \\errorortografico. `words` are the repetition.word_matches of
+    view.text when already found. Acronyms, words with digits, the pieces of URLs and the capitalized
+    words that don't start a sentence (names) aren't checked."""
+    text = view.text
+    if words is None:
+        words = [(match.group(0).lower(), match.start(), match.end()) for match in glossary_word_pattern.finditer(text)]
+    urls = [match.span() for match in url_pattern.finditer(text)] if "www" in text or "://" in text else []
+    for word, start, end in words:
+        original = text[start:end]
+        if len(word) < 2 or word in known or not original.isalpha() or any(letter.isupper() for letter in original[1:]):
+            continue
+        if original[0].isupper() and not sentence_start(text, start):
+            continue
+        if urls and any(url_start <= start < url_end for url_start, url_end in urls):
+            continue
+        if dictionary.contains(word):
+            continue
+        suggestions = dictionary.suggestions(word)
+        message = "Error ortográfico" + (f"; ¿quisiste decir {', '.join(suggestions)}?" if suggestions else "")
+        view.add_mark(start, end, r'\errorortografico{', '}', "spelling", message)
+        comments += 1
+    return comments
@@ -1,7 +1,11 @@
+import bisect
 import re
+import time
+from collections import defaultdict
 from enum import Enum, auto
 
 import spacy
+from spacy.matcher import Matcher
 
 class LineType(Enum):
     SECTION = auto()
@@ -29,43 +33,128 @@ class NoteType(Enum):
     CHAPTER_MISSING_INTRO = "El capítulo debe tener un párrafo introductorio antes de una sección."
     ADJ = auto()
 
-nlp = spacy.load("es_core_news_sm")
+# The checkers only read lemma_, pos_, morph and sentence boundaries. The fast
+# mode drops the dependency parser and the NER and splits sentences with the
+# rule-based sentencizer; the accurate mode loads the whole model.
+nlp_modes = ("accurate", "fast")
+nlp_pipelines = {}
+nlp = None
+
+def load_pipeline(mode: str):
+    if mode == "fast":
+        pipeline = spacy.load("es_core_news_sm", exclude=["parser", "ner"])
+        pipeline.add_pipe("sentencizer")
+        return pipeline
+    if mode == "accurate":
+        return spacy.load("es_core_news_sm")
+    raise ValueError(f"Unknown mode '{mode}', expected one of {nlp_modes}")
+
+def set_nlp_mode(mode: str):
+    """Makes the pipeline of `mode` the one used by every checker, loading it the first time."""
+    global nlp
+    if mode not in nlp_pipelines:
+        nlp_pipelines[mode] = load_pipeline(mode)
+    nlp = nlp_pipelines[mode]
+    return nlp
+
+def get_nlp():
+    return nlp if nlp is not None else set_nlp_mode("accurate")
+
+def drop_nlp_caches():
+    """Forgets the loaded pipelines other than the one in use."""
+    for mode, pipeline in list(nlp_pipelines.items()):
+        if pipeline is not nlp:
+            del nlp_pipelines[mode]
+    for key in list(rule_matchers):
+        if nlp is None or key[0] is not nlp.vocab:
+            del rule_matchers[key]
+
+# When set, the checkers parse long texts in pieces of at most this many
+# characters, so a single spaCy Doc stays small (see memory.MemoryReport).
+max_doc_chars = None
+# When set (a parse_cache.ParseCache), the texts parsed before are read from it
+parse_cache = None
+# When set (a metrics.Metrics), the time of every parse is added to it
+metrics = None
+
+def parse(pipeline, text):
+    start = time.perf_counter()
+    doc = pipeline(text) if parse_cache is None else parse_cache.parse(pipeline, text)
+    if metrics is not None:
+        metrics.observe("parse_seconds", time.perf_counter() - start)
+    return doc
+
+def parse_chunks(text, pipeline=None, parse_text=None):
+    """Yields (offset, doc) pairs that cover `text`, cut after a sentence or a word when possible.
+    With a `pipeline` (and `parse_text`, that parses one piece with it) the module settings
+    above are left alone and the pieces are only cut at pipeline.max_length."""
+    if pipeline is None:
+        pipeline = get_nlp()
+        # spaCy refuses texts longer than max_length, a single huge line is cut too
+        limit = pipeline.max_length if max_doc_chars is None else min(max_doc_chars, pipeline.max_length)
+        parse_text = lambda piece: parse(pipeline, piece)
+    else:
+        limit = pipeline.max_length
+        parse_text = parse_text or pipeline
+    if len(text) <= limit:
+        yield 0, parse_text(text)
+        return
+    start = 0
+    while start < len(text):
+        end = min(start + limit, len(text))
+        if end < len(text):
+            cut = text.rfind(". ", start, end)
+            if cut <= start:
+                cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut + 1
+        yield start, parse_text(text[start:end])
+        start = end
+
+# Longest argument of a command that the patterns look for: an argument that
+# is never closed is read this far instead of to the end of the paragraph
+max_command_argument = 1000
+
+# Pattern to match wrong citations
+cite_usage_pattern = re.compile(r'''
+(
+    ([^\s~] |       # Option 1: Non-whitespace char that's not ~
+        [.,;:!?]\s*    # Option 2: Punctuation followed by optional whitespace
+    )
+    (\\cite\{[^}\n]{0,%d}\})    # The \cite command itself (up to max_command_argument characters)
+)
+''' % max_command_argument, re.VERBOSE)
 
-def fix_cite_usage(latex_text):
+def fix_cite_usage(latex_text, edits=None):
     """
     Finds and comments problematic \cite commands where:
     1. Preceded by punctuation (.,;:!?) with optional whitespace
     2. Immediately preceded by any non-whitespace character except ~
     
     Wraps as: [preceding text] \comment{\cite{content}}{Incorrect citation format}
+
+    If `edits` is a list, it receives (start, end, new_length) for every
+    replaced span of `latex_text`, in order.
     """
-    # Pattern to match wrong citations
-    pattern = r'''
-    (
-        ([^\s~] |       # Option 1: Non-whitespace char that's not ~
-            [.,;:!?]\s*    # Option 2: Punctuation followed by optional whitespace
-        )
-        (\\cite\{.*?\})    # The \cite command itself
-    )
-    '''
-    
     # Replacement function
     def replacer(match):
         preceding_char = match.group(2).strip()
         cite_cmd = match.group(3)
         # Insert space between preceding text and comment
-        return f'{preceding_char} \\comment{{{cite_cmd}}}{{Incorrect citation format}}'
+        result = f'{preceding_char} \\comment{{{cite_cmd}}}{{Incorrect citation format}}'
+        if edits is not None:
+            edits.append((match.start(), match.end(), len(result)))
+        return result
     
     # Apply replacement
-    fixed_text = re.sub(
-        pattern,
-        replacer,
-        latex_text,
-        flags=re.VERBOSE
-    )
+    fixed_text = cite_usage_pattern.sub(replacer, latex_text)
     
     return fixed_text
 
+def detect_bad_citations(latex_text):
+    """Returns the (start, end) spans of the \cite commands fix_cite_usage would comment."""
+    return [match.span(3) for match in cite_usage_pattern.finditer(latex_text)]
+
 def get_package_details(line):
     """Extract package name and options from a \\usepackage command."""
     
@@ -140,142 +229,272 @@ def merge_dicts_by_start_order(dict1, dict2):
     
     # Extract texts in order and join with ""
     merged_text = "".join(text for (start, end, text) in combined_sorted)
-    
+
     return merged_text
 
-def detect_passive_voice(text):
-    doc = nlp(text)
-    spans = []
 
-    for i in range(len(doc) - 1):
-        token = doc[i]
-        # Match any form of 'ser' as a VERB (e.g., "es", "fue", "son", "serán")
-        if token.lemma_ == "ser" and token.pos_ in ("AUX", "VERB"):
-            # Look ahead a few tokens for a past participle
-            for j in range(i + 1, min(i + 2, len(doc))):
-                next_token = doc[j]
-                if (next_token.pos_ in ("VERB") and "VerbForm=Part" in next_token.morph) or (next_token.pos_ != "ADJ" and next_token.text.lower().endswith(("ado", "ido", "to", "so", "cho"))):  # Past participle
-                    span = doc[i:j + 1]
-                    spans.append((span.start_char, span.end_char))
+# what's left of an ignored piece without its command names and braces: its own content
+# (an argument, a formula), which separates the words on both sides of it
+ignored_markup_pattern = re.compile(r'\\[a-zA-Z@]+\*?|[{}\s]')
+
+class SegmentView:
+    """
+    Presents the analyzable pieces of a paragraph as one logical text.
+
+    The paragraph is split once with separate_latex_commands. `text` is the
+    concatenation of the pieces to analyze, and every checker reports its
+    findings as marks (start, end, before, after) over `text`. render() writes
+    the marks back into the original paragraph, so the LaTeX commands and math
+    that were ignored come out untouched. When an ignored argument or formula
+    splits two words (palabra\\footnote{nota}siguiente), a space in `text`
+    keeps them apart; that space belongs to no piece and takes no marks.
+    """
+
+    def __init__(self, paragraph: str):
+        self.paragraph = paragraph
+        to_ignore, to_analyze = separate_latex_commands(paragraph)
+
+        # pieces in start order: [original_start, text, logical_start or None]
+        self.pieces = []
+        self.starts = []   # logical start of each analyzable piece
+        self.indexes = []  # position in self.pieces of each analyzable piece
+        self.boundaries = set()  # logical positions of the spaces added between pieces
+        analyzable = []
+        logical_pos = 0
+        separated = False  # an ignored piece with content of its own since the last analyzable one
+        combined = sorted({**to_ignore, **to_analyze}.items(), key=lambda x: x[0][0])
+        for (start, end), value in combined:
+            if (start, end) in to_analyze:
+                if separated and analyzable and analyzable[-1][-1:].isalnum() and value[:1].isalnum():
+                    self.boundaries.add(logical_pos)
+                    analyzable.append(" ")
+                    logical_pos += 1
+                separated = False
+                self.starts.append(logical_pos)
+                self.indexes.append(len(self.pieces))
+                self.pieces.append([start, value, logical_pos])
+                analyzable.append(value)
+                logical_pos += len(value)
+            else:
+                self.pieces.append([start, value, None])
+                separated = separated or bool(ignored_markup_pattern.sub("", value))
+        self.text = "".join(analyzable)
+        self.marks = []
+
+    def add_mark(self, start: int, end: int, before: str, after: str, rule: str = "", message: str = ""):
+        """Wraps text[start:end] with `before` and `after` when rendering.
+        `rule` and `message` describe the finding in the annotations output."""
+        if start in self.boundaries:
+            start += 1
+        if end - 1 in self.boundaries:
+            end -= 1
+        if start < end:
+            self.marks.append((start, end, before, after, rule, message))
+
+    def to_original(self, position: int) -> int:
+        """Maps an offset in the logical text to an offset in the paragraph."""
+        index = bisect.bisect_right(self.starts, position) - 1
+        if index < 0:
+            return 0
+        start, _, logical_start = self.pieces[self.indexes[index]]
+        return start + position - logical_start
+
+    def _piece_end(self, position: int) -> int:
+        """Logical end of the analyzable piece that contains `position`."""
+        index = bisect.bisect_right(self.starts, position) - 1
+        _, value, logical_start = self.pieces[self.indexes[index]]
+        return logical_start + len(value)
+
+    def _clip(self, start: int, end: int) -> int:
+        # A mark may only cross ignored pieces if they don't leave a brace open,
+        # otherwise it would close inside an ignored command (\textbf{...).
+        piece_end = self._piece_end(start)
+        if end <= piece_end:
+            return end
+        depth = 0
+        for character in self.paragraph[self.to_original(start):self.to_original(end - 1) + 1]:
+            if character == '{':
+                depth += 1
+            elif character == '}':
+                depth -= 1
+                if depth < 0:
+                    return piece_end
+        return end if depth == 0 else piece_end
+
+    def accepted_marks(self):
+        """Indexes in `marks` of the marks render applies, outer marks first."""
+        accepted = []
+        open_ends = []
+        # marks that cross an accepted mark are not rendered
+        for index in sorted(range(len(self.marks)), key=lambda i: (self.marks[i][0], -self.marks[i][1])):
+            start, end = self.marks[index][:2]
+            end = self._clip(start, end)
+            while open_ends and open_ends[-1] <= start:
+                open_ends.pop()
+            if open_ends and end > open_ends[-1]:
+                continue
+            open_ends.append(end)
+            accepted.append(index)
+        return accepted
+
+    def render(self) -> str:
+        """Rebuilds the paragraph with every mark applied."""
+        opens = defaultdict(list)
+        closes = defaultdict(list)
+        for index in self.accepted_marks():
+            start, end, before, after, _, _ = self.marks[index]
+            end = self._clip(start, end)
+            opens[start].append(before)
+            closes[end].insert(0, after)
+
+        positions = sorted(set(opens) | set(closes))
+        result = []
+        next_position = 0
+        for start, value, logical_start in self.pieces:
+            if logical_start is None:
+                result.append(value)
+                continue
+            logical_end = logical_start + len(value)
+            current = logical_start
+            while next_position < len(positions) and positions[next_position] <= logical_end:
+                position = positions[next_position]
+                result.append(self.text[current:position])
+                result.extend(closes.pop(position, ()))
+                current = position
+                # a mark starting at the end of a piece opens in the next one
+                if position == logical_end and position in opens:
                     break
+                result.extend(opens.pop(position, ()))
+                next_position += 1
+            result.append(self.text[current:logical_end])
+        return "".join(result)
+
+# Reglas de voz pasiva y de 1ra/2da persona como patrones de tokens. Cada
+# conjunto se compila una vez por pipeline en un Matcher (ver rule_matcher),
+# así que una regla nueva es un patrón más y no otro bucle en Python.
+ser_token = {"LEMMA": "ser", "POS": {"IN": ["AUX", "VERB"]}}
+participle_token = {"POS": "VERB", "MORPH": {"IS_SUPERSET": ["VerbForm=Part"]}}
+first_second_person = {"INTERSECTS": ["Person=1", "Person=2"]}
+person_pronouns = ["yo", "tú", "vos", "usted", "ustedes", "nosotros", "nosotras", "vosotros", "vosotras", "me"]
+
+passive_voice_rules = {
+    # 'ser' followed by a past participle, or by a word with a participle ending
+    "PASSIVE_PARTICIPLE": [[ser_token, participle_token]],
+    "PASSIVE_ENDING": [[ser_token, {"POS": {"NOT_IN": ["ADJ"]}, "LOWER": {"REGEX": r"(ado|ido|to|so|cho)$"}}]],
+}
+
+person_rules = {
+    "PRONOUN": [[{"LOWER": {"IN": person_pronouns}, "POS": "PRON", "IS_ALPHA": True}]],
+    # compound verbs: 1st/2nd person auxiliary and a participle at most two tokens later
+    "COMPOUND": [[{"POS": "AUX", "MORPH": first_second_person, "IS_ALPHA": True}, participle_token],
+                 [{"POS": "AUX", "MORPH": first_second_person, "IS_ALPHA": True}, {}, participle_token]],
+    "AUX": [[{"POS": "AUX", "MORPH": first_second_person, "IS_ALPHA": True}]],
+    "VERB": [[{"POS": "VERB", "MORPH": first_second_person, "IS_ALPHA": True}]],
+}
+
+rule_matchers = {}
+
+def compile_rules(vocab, rules):
+    """A Matcher of `rules` for the Vocab of a pipeline."""
+    matcher = Matcher(vocab)
+    for name, patterns in rules.items():
+        matcher.add(name, patterns)
+    return matcher
+
+def rule_matcher(vocab, rules):
+    """The Matcher of `rules` for the Vocab of a pipeline, compiled the first time it's used."""
+    key = (vocab, id(rules))
+    if key not in rule_matchers:
+        # two threads may compile it at once, both keep the same one
+        rule_matchers.setdefault(key, compile_rules(vocab, rules))
+    return rule_matchers[key]
+
+def match_rules(doc, rules, matchers=None):
+    """(rule, start token, end token) of every match of `rules` in `doc`, in token order.
+    `matchers` maps id(rules) to its compiled Matcher; without it rule_matcher's is used."""
+    matcher = matchers[id(rules)] if matchers else rule_matcher(doc.vocab, rules)
+    strings = doc.vocab.strings
+    matches = [(strings[match_id], start, end) for match_id, start, end in matcher(doc)]
+    return sorted(matches, key=lambda match: (match[1], match[2]))
+
+def detect_passive_voice(text, docs=None, matchers=None):
+    """`docs` are the (offset, doc) pairs of parse_chunks(text) when already parsed;
+    `matchers` as in match_rules."""
+    spans = []
+
+    for offset, doc in parse_chunks(text) if docs is None else docs:
+        # both rules can match the same 'ser' + participle, keep it once
+        for start in dict.fromkeys(start for _, start, _ in match_rules(doc, passive_voice_rules, matchers)):
+            span = doc[start:start + 2]
+            spans.append((offset + span.start_char, offset + span.end_char))
     return spans
 
-def detectar_primera_segunda_persona(texto):
-    doc = nlp(texto)
+def detectar_primera_segunda_persona(texto, docs=None, matchers=None):
+    """`docs` are the (offset, doc) pairs of parse_chunks(texto) when already parsed;
+    `matchers` as in match_rules."""
     spans = {}
-    pronouns = {"yo", "tú", "vos", "usted", "ustedes", "nosotros", "nosotras", "vosotros", "vosotras", "me"}
-    adj_spans = []
-    i = 0
-    while i < len(doc):
-        token = doc[i]
-        if not token.text.isalpha():
-            i+=1
-            continue
-        # Always highlight personal pronouns
-        if token.text.lower() in pronouns and token.pos_ == "PRON":
-            spans[token.idx, token.idx + len(token.text)] = "Person"
-        
-        # Check for compound verbs (aux + participle) in 1st/2nd person
-        if token.pos_ == "AUX" and ("Person=1" in token.morph or "Person=2" in token.morph):
-            # Look ahead for participle
-            compound = False
-            for j in range(i + 1, min(i + 3, len(doc))):
-                next_token = doc[j]
-                if (next_token.pos_ == "VERB" and "VerbForm=Part" in next_token.morph):
-                    span_start = token.idx
-                    span_end = next_token.idx + len(next_token.text)
-                    spans[span_start, span_end] = "Person"
-                    i = span_end
-                    compound = True
-                    break
-            if not compound:
-                spans[token.idx, token.idx + len(token.text)] = "Person"
-            
-        
-        # Check for simple verbs in 1st/2nd person
-        elif token.pos_ == "VERB" and ("Person=1" in token.morph or "Person=2" in token.morph):
-            print(token.morph)
-            spans[token.idx, token.idx + len(token.text)] = "Person"
-        
+    for offset, doc in parse_chunks(texto) if docs is None else docs:
+        matches = match_rules(doc, person_rules, matchers)
+        # the shortest compound verb that starts at each auxiliary
+        compounds = {}
+        for rule, start, end in matches:
+            if rule == "COMPOUND":
+                compounds[start] = min(end, compounds.get(start, end))
+        # the tokens inside a compound verb aren't checked again
+        skip_until = 0
+        for rule, start, end in matches:
+            if rule == "COMPOUND" or start < skip_until:
+                continue
+            if rule == "AUX" and start in compounds:
+                end = skip_until = compounds[start]
+            span = doc[start:end]
+            spans[offset + span.start_char, offset + span.end_char] = "Person"
+
         # Check for adjectives
         ##############################################
         ############# COMMENTING ADJs FOR NOW ########
         ##############################################
         # elif token.pos_ == "ADJ":
         #     spans[token.idx, token.idx + len(token.text)] = "ADJ"
-        i+=1
     return spans
 
 
-def mark_first_second_person(doc_content:str, comments) ->str:
+def mark_first_second_person(view: SegmentView, comments, docs=None, matchers=None) -> int:
     # Step 2:[] Highlight first/second person verbs, pronouns, and adjectives
-    spans = detectar_primera_segunda_persona(doc_content)
+    spans = detectar_primera_segunda_persona(view.text, docs, matchers)
     # Sort spans by start position to process them in order
-    spans = sorted(spans.items(), key=lambda x: x[0][0])
-    offset = 0
-    index = 0
-    while index < len(spans):
-        curr_span = spans[index]
-        start = curr_span[0][0]
-        end = curr_span[0][1]
-        real_start = start + offset
-        real_end = end + offset
-        # Skip if this span is already inside a previous highlight
-        # if any(s <= real_start and real_end <= e for (s, e) in spans.keys() if s < start):
-        #     continue
-        original = doc_content[real_start:real_end]
-        comment_text = "{Escribir en 3ra persona.} "
-        if curr_span[1] == "ADJ":
-            comment_text = "{Adjetivo.} "
-        wrapped = '\comment {'+original+'}' + comment_text
+    for (start, end), kind in sorted(spans.items(), key=lambda x: x[0][0]):
+        comment_text = "Escribir en 3ra persona."
+        if kind == "ADJ":
+            comment_text = "Adjetivo."
+        view.add_mark(start, end, r'\comment {', '}{' + comment_text + '} ', "person", comment_text)
         comments +=1
-        doc_content = doc_content[:real_start] + wrapped + doc_content[real_end:]
-        offset += len(wrapped) - (end - start)
-        index += 1
-
-    return doc_content, comments
-
-def mark_passive_voice(doc_content:str, comments) -> str:
-    # Step 1: Highlight passive voice (ser + participle) and returns the text highlighted
-    spans = detect_passive_voice(doc_content)
-    offset = 0
-    for start, end in spans:
-        real_start = start + offset
-        real_end = end + offset
-        original = doc_content[real_start:real_end]
-        wrapped = '\comment {'+original+'}{Voz pasiva} '
+
+    return comments
+
+def mark_passive_voice(view: SegmentView, comments, docs=None, matchers=None) -> int:
+    # Step 1: Highlight passive voice (ser + participle) over the paragraph's analyzable text
+    for start, end in detect_passive_voice(view.text, docs, matchers):
+        view.add_mark(start, end, r'\comment {', '}{Voz pasiva} ', "passive_voice", "Voz pasiva")
         comments +=1
-        doc_content = doc_content[:real_start] + wrapped + doc_content[real_end:]
-        offset += len(wrapped) - (end - start)
-    return doc_content, comments
+    return comments
 
 
-def mark_weasel_spanglish(weasel_words, spanglish_words, doc_content:str, comments) -> str:
-    
-    for word in weasel_words:
+def mark_weasel_spanglish(weasel_words, spanglish_words, view: SegmentView, comments) -> int:
+
+    # dict.fromkeys drops repeated entries, which would wrap the same span twice
+    for word in dict.fromkeys(weasel_words):
         pattern = r'\b' + re.escape(word) + r'\b'
-        new_content, num_subs = re.subn(
-            pattern,
-            lambda m: r'\comadreja{' + m.group(0) + '}',
-            doc_content,
-            flags=re.IGNORECASE
-        )
-        if num_subs > 0:
-            doc_content = new_content
-            comments += num_subs
-
-    for word in spanglish_words:
+        for match in re.finditer(pattern, view.text, flags=re.IGNORECASE):
+            view.add_mark(match.start(), match.end(), r'\comadreja{', '}', "weasel", "Palabra comadreja")
+            comments += 1
+
+    for word in dict.fromkeys(spanglish_words):
         pattern = r'\b' + re.escape(word) + r'\b'
-        new_content, num_subs = re.subn(
-            pattern,
-            lambda m: r'\comment {' + m.group(0) + '}{Anglicismo}',
-            doc_content,
-            flags=re.IGNORECASE
-        )
-        if num_subs > 0:
-            doc_content = new_content
-            comments += num_subs
-    return doc_content, comments
+        for match in re.finditer(pattern, view.text, flags=re.IGNORECASE):
+            view.add_mark(match.start(), match.end(), r'\comment {', '}{Anglicismo}', "anglicism", "Anglicismo")
+            comments += 1
+    return comments
 
 
 def line_classifier(line: str) -> LineType:
@@ -363,6 +582,11 @@ def check_number(line: str) -> str:
     highlighted += "\\notaparaelautor{No pongas el número de la sección tú a mano. Deja que LaTeX se encargue de eso.}\n"
     return highlighted
 
+def heading_title(line: str) -> str:
+    """Returns the title of a \\chapter or \\section declaration, or the line itself."""
+    match = re.match(r'^\s*\\(?:chapter|part|(?:sub)*section)\*?\s*\{(.*)\}', line)
+    return match.group(1).strip() if match else line.strip()
+
 def add_note(type: NoteType,line: str) -> str:
     line += "\n" + "\\notaparaelautor{" + type.value + "}\n"
     return line
@@ -371,7 +595,82 @@ def check_spanglish(line: str) -> str:
     spanglish_words = ["parsear, revolver"]
 
 
-import re
+# This regex finds the first '%' that is NOT preceded by a '\'.
+# (?<!\\) is a "negative lookbehind". It asserts that the character
+# immediately preceding the current position is not a backslash.
+inline_comment_pattern = re.compile(r'(?<!\\)%')
+
+# The commands that get their own line: \begin{...} or \end{...}, the
+# headings (starred versions too, like \section*{...}), \item, \[ and \].
+# A heading only counts once its argument is closed by a } on the same line,
+# which add_command_line_breaks checks without a regex (see there).
+line_break_command_start = re.compile(
+    r'\\(?:begin|end)\{[a-zA-Z0-9*]+\}'
+    r'|\\(?:chapter|(?:sub)*section)\*?\{'
+    r'|\\item'
+    r'|\\\[|\\\]'
+)
+non_space_pattern = re.compile(r'\S')
+
+
+def remove_inline_comment(line: str) -> str:
+    """Removes the inline comment of a single line (see remove_inline_comments)."""
+    match = inline_comment_pattern.search(line)
+
+    if match:
+        # A potential comment symbol was found.
+        # Let's see what comes before it.
+        content_before_comment = line[:match.start()]
+
+        # The core condition: is there any non-whitespace text before the '%'?
+        if content_before_comment.strip():
+            # Yes. This is an inline comment.
+            # We keep the content before the comment and remove any trailing spaces.
+            return content_before_comment.rstrip()
+    # No comment, or a full-line comment (whitespace and then a '%'): keep the line.
+    return line
+
+
+def add_command_line_breaks(line: str) -> str:
+    """Adds the line breaks of format_latex_commands to a single line."""
+    # Check if the line is a comment. A comment starts with '%',
+    # ignoring any leading whitespace.
+    if line.strip().startswith('%'):
+        # If it's a comment, keep it without changes.
+        return line
+    # Same result as substituting (\S.*?)(command) with text + '\n' + command
+    # (+ '\n' unless it's an \item), but linear: that regex tries every
+    # length of the preceding text at every start, and scans to the end of
+    # the line for every heading that is never closed.
+    result = []
+    position = 0
+    next_close = -2  # first } after the heading being checked, -1 if there's none
+    while True:
+        text_start = non_space_pattern.search(line, position)
+        if text_start is None:
+            break
+        search_from = text_start.start() + 1
+        command = None
+        while True:
+            match = line_break_command_start.search(line, search_from)
+            if match is None or not match.group(0).endswith('{'):
+                command = match and match.span()
+                break
+            if next_close != -1 and next_close < match.end():
+                next_close = line.find('}', match.end())
+            if next_close != -1:
+                command = (match.start(), next_close + 1)
+                break
+            search_from = match.start() + 1
+        if command is None:
+            break
+        start, end = command
+        result.append(line[position:start] + '\n' + line[start:end])
+        if not line.startswith(r'\item', start):
+            result.append('\n')
+        position = end
+    result.append(line[position:])
+    return ''.join(result)
 
 
 def remove_inline_comments(text: str) -> str:
@@ -393,38 +692,11 @@ def remove_inline_comments(text: str) -> str:
     Returns:
         A new string with inline comments removed.
     """
-    processed_lines = []
-    
-    for line in text.splitlines():
-        # This regex finds the first '%' that is NOT preceded by a '\'.
-        # (?<!\\) is a "negative lookbehind". It asserts that the character
-        # immediately preceding the current position is not a backslash.
-        match = re.search(r'(?<!\\)%', line)
-
-        if match:
-            # A potential comment symbol was found.
-            # Let's see what comes before it.
-            comment_start_index = match.start()
-            content_before_comment = line[:comment_start_index]
-
-            # The core condition: is there any non-whitespace text before the '%'?
-            if content_before_comment.strip():
-                # Yes. This is an inline comment.
-                # We keep the content before the comment and remove any trailing spaces.
-                processed_lines.append(content_before_comment.rstrip())
-            else:
-                # No. The line starts with whitespace and then a '%'.
-                # This is a full-line comment, so we keep the original line.
-                processed_lines.append(line)
-        else:
-            # No comment symbol found on this line, so keep it as is.
-            processed_lines.append(line)
-            
     # Join the processed lines back together into a single string.
-    return '\n'.join(processed_lines)
+    return '\n'.join(remove_inline_comment(line) for line in text.splitlines())
 
 
-def format_latex_commands(text: str) -> str:
+def format_latex_commands(text: str, positions: list = None) -> str:
     """
     Finds specific LaTeX commands and adds line breaks around them,
     but only on lines that are not LaTeX comments.
@@ -450,59 +722,72 @@ def format_latex_commands(text: str) -> str:
 
     Args:
         text: The input string containing LaTeX code.
+        positions: Optional list that receives, for every line of the result,
+            the (line, column) where it starts in `text`, both 0-based.
 
     Returns:
         A new string with formatted line breaks.
     """
-    # --- The original regex logic, which is perfect for processing a single line ---
-
-    # This part of the pattern defines all the commands we want to find.
-    # It is wrapped in parentheses to become a capturing group (group 2).
-    command_pattern_group = (
-        r'('
-        r'\\(?:begin|end)\{[a-zA-Z0-9*]+\}'             # \begin{...} or \end{...}
-        # Updated to handle starred versions like \section*{...}
-        r'|\\(?:chapter|(?:sub)*section)\*?\{.*?\}'
-        r'|\\item'                                      # \item
-        r'|\\\[|\\\]'                                   # \[ or \]
-        r')'
-    )
+    processed_lines = []
 
-    # The full pattern now does two things:
-    # 1. `(\S.*?)`: This is group 1. It captures any preceding text on the same line.
-    # 2. `command_pattern_group`: This is group 2, which captures the command itself.
-    pattern = re.compile(r'(\S.*?)' + command_pattern_group)
+    for number, line in enumerate(text.splitlines()):
+        processed_line = add_command_line_breaks(line)
+        processed_lines.append(processed_line)
+        if positions is not None:
+            append_line_positions(positions, number, processed_line)
 
-    def replacer(match):
-        """
-        This function is called for each match and defines the replacement.
-        """
-        preceding_text = match.group(1)
-        command = match.group(2)
-        result = preceding_text + '\n' + command
-        if not command.startswith(r'\item'):
-            result += '\n'
-        return result
+    # Join the processed lines back into a single string.
+    # splitlines() removes newlines, so we must add them back.
+    return '\n'.join(processed_lines)
 
-    # --- New logic to process the text line by line ---
 
-    lines = text.splitlines()
-    processed_lines = []
+def append_line_positions(positions: list, number: int, processed_line: str):
+    # the substitution only inserts line breaks, so each new line
+    # starts where the previous ones end in the original line
+    column = 0
+    for part in processed_line.split('\n'):
+        positions.append((number, column))
+        column += len(part)
 
-    for line in lines:
-        # Check if the line is a comment. A comment starts with '%',
-        # ignoring any leading whitespace.
-        if line.strip().startswith('%'):
-            # If it's a comment, add it to our results without changes.
-            processed_lines.append(line)
+
+def preprocess_lines(text: str, positions: list = None):
+    """
+    Yields the lines of the document body ready for line_classifier, in one pass.
+
+    Equivalent to remove_inline_comments, then format_latex_commands and then
+    split('\\n'), without building the intermediate copies of the whole body.
+    `positions` is filled as in format_latex_commands.
+    """
+    # format_latex_commands splits the joined output of remove_inline_comments
+    # again, which drops a trailing empty line: hold empty lines back until
+    # we know they aren't the last one.
+    held = None
+    yielded = False
+    for number, line in enumerate(text.splitlines()):
+        processed_line = remove_inline_comment(line)
+        if held is not None:
+            if positions is not None:
+                positions.append((held, 0))
+            yield ""
+            yielded = True
+            held = None
+        if not processed_line:
+            held = number
+            continue
+        processed_line = add_command_line_breaks(processed_line)
+        if positions is not None:
+            append_line_positions(positions, number, processed_line)
+        if '\n' in processed_line:
+            yield from processed_line.split('\n')
         else:
-            # If it's not a comment, apply the regex substitution to the line.
-            processed_line = pattern.sub(replacer, line)
-            processed_lines.append(processed_line)
+            yield processed_line
+        yielded = True
+    if not yielded:
+        # an empty body still is one (empty) line after split('\\n')
+        if positions is not None:
+            positions.append((0, 0))
+        yield ""
 
-    # Join the processed lines back into a single string.
-    # splitlines() removes newlines, so we must add them back.
-    return '\n'.join(processed_lines)
 
 # def get_begin_end_block(lines, index): # if the block is not to be ignored I gather each paragraph and process it with th corresponding method
 #     line = lines[index]
@@ -618,13 +903,14 @@ def get_math_block(lines, index):
 
 
 
-def process_section_chapter_declaration(lines, i, weasels, spanglish):
+def process_section_chapter_declaration(lines, i, weasels, spanglish, pipeline=None):
     line = lines[i]
     line = check_number(line) # if the number is written it highlights it
     # line = mark_first_second_person_and_adject(line)
     # line = mark_passive_voice(line)
     errors = ''
-    doc = nlp(line)
+    # only the words are compared, the tokenizer is enough
+    doc = (pipeline or get_nlp()).make_doc(line)
     for word in doc:
         if word.text in weasels:
             errors += f"la palabra comadreja: {word.text}, "
@@ -676,11 +962,10 @@ def find_balance_symbol(start_symbol, end_symbol, text, position):
     return position
 
 def get_first_non_empty_char(text, position):
-    character = text[position]
-    init_position = position
-    while character == " " and position < len(text):
-        position+=1
-        character = text[position]
+    """Skips the spaces at `position`; the character found is "" at the end of the text."""
+    while position < len(text) and text[position] == " ":
+        position += 1
+    character = text[position] if position < len(text) else ""
     return position, character
 
 def call_optional_method(text, position, envs, to_ignore, to_analyze):
@@ -689,11 +974,8 @@ def call_optional_method(text, position, envs, to_ignore, to_analyze):
         This method is only for commands to ignore'''
     env_index = 0
     while env_index < len(envs) and position < len(text):
-        character = text[position]
         init_position = position
-        while character == " ":
-            position+=1
-            character = text[position]
+        position, character = get_first_non_empty_char(text, position)
         if position != init_position:
             to_analyze[init_position, position] = text[init_position: position]
         while env_index < len(envs):
@@ -768,11 +1050,68 @@ def commands_to_consider_method(command, text, position, matches, index, to_igno
     #     add_span(m.span(), False)
 
     # Step 2: mark all command spans
+max_brace_depth = 100
+brace_pattern = re.compile(r'[{}]')
+
+def brace_depth(text):
+    depth = max_depth = 0
+    for match in brace_pattern.finditer(text):
+        if match.group(0) == '{':
+            depth += 1
+            max_depth = max(max_depth, depth)
+        else:
+            depth -= 1
+    return max_depth
+
+# Math: $$...$$, $...$, \[...\] and \(...\)
+math_opener_pattern = re.compile(r'\$|\\[\[(]')
+math_closers = {"$$": "$$", "$": "$", "\\[": "\\]", "\\(": "\\)"}
+
+def find_math_spans(text):
+    """
+    The spans of the math in `text`, the same as the matches of
+    $$.*?$$|$.*?$|\\[.*?\\]|\\(.*?\\) with re.DOTALL, in linear time: once a
+    closer isn't found after some position it isn't looked for again, while
+    the regex would read to the end of the text for every opener left open.
+    """
+    spans = []
+    missing = set()
+    position = 0
+    while True:
+        match = math_opener_pattern.search(text, position)
+        if match is None:
+            return spans
+        start = match.start()
+        openers = ("$$", "$") if text.startswith("$$", start) else (match.group(0),)
+        end = None
+        for opener in openers:
+            closer = math_closers[opener]
+            if closer in missing:
+                continue
+            found = text.find(closer, start + len(opener))
+            if found == -1:
+                missing.add(closer)
+                continue
+            end = found + len(closer)
+            break
+        if end is None:
+            position = start + 1
+        else:
+            spans.append((start, end))
+            position = end
+
 def separate_latex_commands(text):
 
     to_ignore = {}
     to_analyze = {}
 
+    # every level of braces of the commands to consider is one more recursive
+    # call; past max_brace_depth the paragraph is left out of the review
+    # (analysis.Analyzer reports it as degraded)
+    if brace_depth(text) > max_brace_depth:
+        to_ignore[0, len(text)] = text
+        return to_ignore, to_analyze
+
     # Matches LaTeX commands like \command[opt](label){arg}{mod1}{mod2}
     command_pattern = re.compile(
         r'''\\[a-zA-Z@]+
@@ -780,19 +1119,14 @@ def separate_latex_commands(text):
         re.VERBOSE
     )
 
-    # Matches math environments
-    math_pattern = re.compile(
-        r'(?P<math>\$\$.*?\$\$|\$.*?\$|\\\[.*?\\\]|\\\(.*?\\\))',
-        re.DOTALL
-    )
 
     brace_end = re.compile(r'}')
 
     matches = {}
     for m in command_pattern.finditer(text):
         matches[m.span()] = [CommandType.COMMAND]
-    for m in math_pattern.finditer(text):
-        matches[m.span()] = [CommandType.MATH]
+    for span in find_math_spans(text):
+        matches[span] = [CommandType.MATH]
     for m in brace_end.finditer(text):
         matches[m.span()] = [CommandType.CLOSE_BRACE]
     matches = sorted(matches.items(), key=lambda x: x[0][0])
@@ -805,7 +1139,6 @@ def separate_latex_commands(text):
 
 def process_command_arg1(depth, curr_pos, matches, index, text, to_ignore, to_analyze):
     commands_to_consider = ['textbf', 'textit', 'hl','comment', 'textcolor', 'comadreja']
-    matches = list(matches) 
     # matches elements are in the form: [[start, end], type]
     index = index
     while index < len(matches):
@@ -828,7 +1161,6 @@ def process_command_arg1(depth, curr_pos, matches, index, text, to_ignore, to_an
                     return curr_pos
             else:
                 to_analyze[match[0][0], match[0][1]] = text[match[0][0]: match[0][1]]
-        print(match[1])
         if match[1][0] is CommandType.COMMAND:
             command_name = text[match[0][0]+1:match[0][1]] # +1 to skip \
             to_ignore[match[0][0], match[0][1]] = text[match[0][0]: match[0][1]]
@@ -840,7 +1172,8 @@ def process_command_arg1(depth, curr_pos, matches, index, text, to_ignore, to_an
         index +=1
     if curr_pos < len(text):
         to_analyze[curr_pos, len(text)] = text[curr_pos: len(text)]
-              
+    # a brace left open reaches the end of the text
+    return max(curr_pos, len(text))
 
 
 
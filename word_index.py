@@ -0,0 +1,96 @@
+from collections import Counter, defaultdict
+
+from frequency import ignored_words
+
+# parts of speech whose lemmas are indexed
+indexed_pos = {"NOUN", "VERB", "ADJ", "ADV"}
+# a lemma is overused in a chapter or section when it appears at least
+# overuse_min_count times and makes up at least overuse_min_share of its indexed words
+overuse_min_count = 10
+overuse_min_share = 0.01
+# lemmas listed in each \notaparaelautor summary
+overuse_note_size = 5
+
+
+class WordIndex:
+    """
+    Inverted index of the lemmas of a whole document.
+
+    `postings` maps each lemma to its positions in document order, as
+    (paragraph id, offset in the paragraph's SegmentView text). The chapter
+    and section of a paragraph are looked up in `paragraph_scopes`, so the
+    overuse of every chapter and section is answered in one pass over the
+    postings instead of scanning the text again.
+    """
+
+    def __init__(self, ignore_words=()):
+        self.ignore_words = ignored_words(ignore_words)
+        self.postings = defaultdict(list)
+        self.paragraph_scopes = []   # paragraph id -> (chapter id, section id)
+        self.chapters = [""]         # chapter id -> title ("" before the first \chapter)
+        self.sections = [""]         # section id -> title
+        self.chapter_words = Counter()
+        self.section_words = Counter()
+
+    def start_chapter(self, title: str):
+        self.chapters.append(title)
+        # a new chapter also closes the current section
+        self.sections.append("")
+
+    def start_section(self, title: str):
+        self.sections.append(title)
+
+    def add_paragraph(self, docs) -> int:
+        """Indexes the lemmas of a paragraph, given the (offset, doc) pairs that
+        parse its analyzable text, and returns the paragraph id."""
+        paragraph_id = len(self.paragraph_scopes)
+        chapter_id = len(self.chapters) - 1
+        section_id = len(self.sections) - 1
+        self.paragraph_scopes.append((chapter_id, section_id))
+        for offset, doc in docs:
+            for token in doc:
+                if token.pos_ not in indexed_pos or not token.is_alpha or token.is_stop:
+                    continue
+                lemma = token.lemma_.lower()
+                if len(lemma) <= 2 or lemma in self.ignore_words:
+                    continue
+                self.postings[lemma].append((paragraph_id, offset + token.idx))
+                self.chapter_words[chapter_id] += 1
+                self.section_words[section_id] += 1
+        return paragraph_id
+
+    def overuse(self):
+        """
+        Returns two dicts, for chapters and for sections, mapping each scope id to
+        its overused lemmas as (lemma, count), the most frequent first.
+        """
+        chapter_counts = defaultdict(Counter)
+        section_counts = defaultdict(Counter)
+        for lemma, positions in self.postings.items():
+            for paragraph_id, _ in positions:
+                chapter_id, section_id = self.paragraph_scopes[paragraph_id]
+                chapter_counts[chapter_id][lemma] += 1
+                section_counts[section_id][lemma] += 1
+        return (overused(chapter_counts, self.chapter_words),
+                overused(section_counts, self.section_words))
+
+    def chapter_notes(self, chapter_overuse):
+        """The \\notaparaelautor summary of each chapter with overused lemmas."""
+        notes = {}
+        for chapter_id, lemmas in chapter_overuse.items():
+            if chapter_id == 0:
+                continue
+            listed = ", ".join(f"{lemma} ({count})" for lemma, count in lemmas[:overuse_note_size])
+            notes[chapter_id] = "\\notaparaelautor{Palabras muy usadas en este capítulo: " + listed + ".}\n"
+        return notes
+
+
+def overused(counts_by_scope, words_by_scope):
+    result = {}
+    for scope_id, counts in counts_by_scope.items():
+        total = words_by_scope[scope_id]
+        lemmas = [(lemma, count) for lemma, count in counts.most_common()
+                  if count >= overuse_min_count and count >= overuse_min_share * total]
+        if lemmas:
+            result[scope_id] = lemmas
+    return result